@@ -1,3 +1,18 @@
-from .send import send
+from .archive import send_archive
+from .assets import Fingerprints
+from .cache import (ContentCache, DescriptorCache, LRUCache, MmapCache,
+                    PathCache)
+from .chunks import (AdaptiveChunkSize, ChunkSize, FileSizeChunkSize,
+                     FixedChunkSize)
+from .compress import Compressor
+from .flight import SingleFlight
+from .listing import DirectoryListing
+from .manifest import Manifest
+from .metrics import Metrics, Observer
+from .pool import IOPool
+from .send import Options, send, send_with
+from .static import StaticFiles
+from .throttle import Throttle, TokenBucket
+from .watch import Watcher
 
 __version__ = '0.0.9'
@@ -0,0 +1,326 @@
+import asyncio
+import os
+import stat
+import struct
+import tarfile
+import time
+import zlib
+from os import path
+from urllib.parse import quote
+
+from aiohttp import web
+
+from .chunks import as_chunk_size
+from .pool import DEFAULT_POOL
+from .send import (DEFAULT_READ_STEP, FileChangedError, FileState, is_hidden,
+                   normalize_path, write_file)
+
+ARCHIVE_TYPES = {
+    'tar': 'application/x-tar',
+    'zip': 'application/zip',
+}
+
+
+async def send_archive(request, file_paths, root='', archive='tar',
+                       filename=None, hidden=True, read_step=DEFAULT_READ_STEP,
+                       sendfile=True, pool=None, throttle=None):
+    """
+    send files and directories under ``root`` in one uncompressed
+    tar or zip archive, generated while it's sent.
+
+    Paths are checked like in ``send``: any path out of ``root``
+    is ``403 Forbidden``, a missing or hidden one ``404 Not Found``,
+    before anything is sent. Directories are added with all their
+    files, leaving out hidden ones when ``hidden`` is ``True``.
+
+    Sizes are those found before sending. A file changed since, or
+    shrinking while it's written, aborts the response, since the archive
+    would be corrupt; one growing meanwhile is cut to its announced size.
+
+    :type request: web.Request
+    :param file_paths: paths relative to ``root``
+    :type file_paths: List[str]
+    :type root: str
+    :param archive: ``tar`` or ``zip``
+    :type archive: str
+    :param filename: suggested to client by ``Content-Disposition``,
+        defaults to ``archive.tar`` or ``archive.zip``
+    :type filename: Union[str, None]
+    :type hidden: bool
+    :type read_step: Union[int, aiohttp_send.ChunkSize]
+    :type sendfile: bool
+    :type pool: Union[aiohttp_send.IOPool, None]
+    :param throttle: limit bandwidth of large archives
+    :type throttle: Union[aiohttp_send.Throttle, None]
+    :rtype: web.StreamResponse
+    """
+    if archive not in ARCHIVE_TYPES:
+        raise ValueError('archive must be one of ' + ', '.join(ARCHIVE_TYPES))
+    pool = pool if pool is not None else DEFAULT_POOL
+    root = path.abspath(path.normpath(root or os.getcwd()))
+    root_prefix = root if root.endswith(path.sep) else root + path.sep
+    targets = []
+    for file_path in file_paths:
+        file_path, _ = normalize_path(root, root_prefix, file_path)
+        if hidden and is_hidden(file_path):
+            raise web.HTTPNotFound()
+        targets.append(file_path)
+    loop = asyncio.get_event_loop()
+    entries = await loop.run_in_executor(
+        pool.executor, _collect, root_prefix, targets, hidden)
+    if entries is None:
+        raise web.HTTPNotFound()
+
+    writer = TarWriter() if archive == 'tar' else ZipWriter()
+    length = writer.length(entries)
+    limiter = None
+    if throttle is not None:
+        limiter = throttle.limiter(request, length)
+    resp = web.StreamResponse(headers={
+        'Content-Type': ARCHIVE_TYPES[archive],
+        'Content-Length': str(length),
+        'Content-Disposition': content_disposition(
+            filename or 'archive.' + archive),
+    })
+    read_step = as_chunk_size(read_step)
+    async with pool:
+        await resp.prepare(request)
+        for name, file_path, stats in entries:
+            head = await writer.head(name, file_path, stats,
+                                     executor=pool.executor)
+            # after zip's CRC was read, so it matches what's sent
+            if await loop.run_in_executor(pool.executor, _changed,
+                                          file_path, stats):
+                raise FileChangedError(file_path)
+            await resp.write(head)
+            if stats.st_size:
+                await write_file(request, resp, file_path, 0, stats.st_size,
+                                 read_step=read_step, sendfile=sendfile,
+                                 executor=pool.executor, limiter=limiter)
+            tail = writer.tail(stats)
+            if tail:
+                await resp.write(tail)
+        await resp.write(writer.end())
+    return resp
+
+
+def content_disposition(filename):
+    """
+    ``attachment`` header value suggesting ``filename``, with an ascii
+    fallback and ``filename*`` for names which aren't plain ascii
+
+    :type filename: str
+    :rtype: str
+    """
+    fallback = ''.join(c if ' ' <= c < '\x7f' and c not in '"\\' else '_'
+                       for c in filename)
+    value = 'attachment; filename="{}"'.format(fallback)
+    if fallback != filename:
+        value += "; filename*=UTF-8''" + quote(filename, safe='',
+                                               errors='surrogateescape')
+    return value
+
+
+def _collect(root_prefix, targets, hidden):
+    """
+    blocking part of ``send_archive``, stat files and walk directories
+
+    :return: archive name, path and stats of each file,
+        ``None`` when one is missing
+    :rtype: Union[List[Tuple[str, str, FileState]], None]
+    """
+    entries = []
+    seen = set()
+
+    def add(file_path, r):
+        if file_path not in seen:
+            seen.add(file_path)
+            name = file_path[len(root_prefix):].replace(path.sep, '/')
+            entries.append((name, file_path, FileState.from_stat(r)))
+
+    for target in targets:
+        try:
+            r = os.stat(target)
+        except OSError:
+            return None
+        if stat.S_ISREG(r.st_mode):
+            add(target, r)
+            continue
+        if not stat.S_ISDIR(r.st_mode):
+            return None
+        for directory, dirs, files in os.walk(target):
+            if hidden:
+                dirs[:] = [d for d in dirs if not d.startswith('.')]
+                files = [f for f in files if not f.startswith('.')]
+            dirs.sort()
+            for name in sorted(files):
+                file_path = path.join(directory, name)
+                try:
+                    r = os.stat(file_path)
+                except OSError:
+                    continue
+                if stat.S_ISREG(r.st_mode):
+                    add(file_path, r)
+    return entries
+
+
+def _changed(file_path, stats):
+    try:
+        r = os.stat(file_path)
+    except OSError:
+        return True
+    return r.st_mtime != stats.st_mtime or r.st_size != stats.st_size
+
+
+class TarWriter:
+    """
+    pax format tar headers and padding around file contents
+    """
+
+    def __init__(self):
+        self.size = 0
+
+    def _header(self, name, stats):
+        info = tarfile.TarInfo(name)
+        info.size = stats.st_size
+        info.mtime = int(stats.st_mtime)
+        info.mode = 0o644
+        return info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape')
+
+    def length(self, entries):
+        size = 0
+        for name, file_path, stats in entries:
+            size += len(self._header(name, stats)) + stats.st_size \
+                + len(self.tail(stats))
+        size += 2 * tarfile.BLOCKSIZE
+        return size + len(self._record_padding(size))
+
+    async def head(self, name, file_path, stats, executor=None):
+        head = self._header(name, stats)
+        self.size += len(head) + stats.st_size + len(self.tail(stats))
+        return head
+
+    def tail(self, stats):
+        return tarfile.NUL * (-stats.st_size % tarfile.BLOCKSIZE)
+
+    def _record_padding(self, size):
+        return tarfile.NUL * (-size % tarfile.RECORDSIZE)
+
+    def end(self):
+        size = self.size + 2 * tarfile.BLOCKSIZE
+        return tarfile.NUL * (2 * tarfile.BLOCKSIZE) \
+            + self._record_padding(size)
+
+
+# sizes and offsets from this need zip64 records
+ZIP64_LIMIT = 0xFFFFFFFF
+
+
+def _crc32(file_path, size):
+    crc = 0
+    with open(file_path, 'rb') as f:
+        while size > 0:
+            b = f.read(min(size, 1024 * 1024))
+            if not b:
+                raise FileChangedError(file_path)
+            crc = zlib.crc32(b, crc)
+            size -= len(b)
+    return crc
+
+
+def _dos_time(st_mtime):
+    t = time.localtime(st_mtime)
+    if t.tm_year < 1980:
+        return 0, (1 << 5) | 1
+    return ((t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2),
+            ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday)
+
+
+class ZipWriter:
+    """
+    store-only zip headers and central directory around file contents.
+
+    CRC32 of a file is computed in the executor before its header is
+    written, since it's needed in the local header, so each file is read
+    twice but the archive length is known before it's sent.
+    """
+
+    def __init__(self):
+        self.offset = 0
+        self.records = []
+
+    def _local_length(self, name, stats):
+        extra = 20 if stats.st_size >= ZIP64_LIMIT else 0
+        return 30 + len(name.encode('utf-8', 'surrogateescape')) + extra
+
+    def _central_length(self, name, stats, offset):
+        zip64 = stats.st_size >= ZIP64_LIMIT or offset >= ZIP64_LIMIT
+        return 46 + len(name.encode('utf-8', 'surrogateescape')) \
+            + (28 if zip64 else 0)
+
+    def length(self, entries):
+        offset = central = 0
+        for name, file_path, stats in entries:
+            central += self._central_length(name, stats, offset)
+            offset += self._local_length(name, stats) + stats.st_size
+        return offset + central + len(self._end(len(entries), offset, central))
+
+    async def head(self, name, file_path, stats, executor=None):
+        loop = asyncio.get_event_loop()
+        crc = await loop.run_in_executor(executor, _crc32, file_path,
+                                         stats.st_size)
+        encoded = name.encode('utf-8', 'surrogateescape')
+        size = stats.st_size
+        mod_time, mod_date = _dos_time(stats.st_mtime)
+        if size >= ZIP64_LIMIT:
+            extra = struct.pack('<2H2Q', 1, 16, size, size)
+            head = struct.pack('<4s5H3L2H', b'PK\x03\x04', 45, 0x800, 0,
+                               mod_time, mod_date, crc, ZIP64_LIMIT,
+                               ZIP64_LIMIT, len(encoded), len(extra))
+        else:
+            extra = b''
+            head = struct.pack('<4s5H3L2H', b'PK\x03\x04', 20, 0x800, 0,
+                               mod_time, mod_date, crc, size, size,
+                               len(encoded), 0)
+        self.records.append((encoded, size, crc, mod_time, mod_date,
+                             self.offset))
+        head += encoded + extra
+        self.offset += len(head) + size
+        return head
+
+    def tail(self, stats):
+        return b''
+
+    def end(self):
+        central = []
+        for encoded, size, crc, mod_time, mod_date, offset in self.records:
+            if size >= ZIP64_LIMIT or offset >= ZIP64_LIMIT:
+                extra = struct.pack('<2H3Q', 1, 24, size, size, offset)
+                size32 = offset32 = ZIP64_LIMIT
+                version = 45
+            else:
+                extra = b''
+                size32, offset32 = size, offset
+                version = 20
+            central.append(struct.pack(
+                '<4s6H3L5H2L', b'PK\x01\x02', (3 << 8) | version, version,
+                0x800, 0, mod_time, mod_date, crc, size32, size32,
+                len(encoded), len(extra), 0, 0, 0, 0o100644 << 16, offset32,
+            ) + encoded + extra)
+        central = b''.join(central)
+        return central + self._end(len(self.records), self.offset,
+                                   len(central))
+
+    def _end(self, count, offset, central_size):
+        end = b''
+        if count >= 0xFFFF or offset >= ZIP64_LIMIT \
+                or central_size >= ZIP64_LIMIT:
+            end += struct.pack('<4sQ2H2L4Q', b'PK\x06\x06', 44, 45, 45, 0,
+                               0, count, count, central_size, offset)
+            end += struct.pack('<4sLQL', b'PK\x06\x07', 0,
+                               offset + central_size, 1)
+            return end + struct.pack('<4s4H2LH', b'PK\x05\x06', 0, 0,
+                                     0xFFFF, 0xFFFF, ZIP64_LIMIT,
+                                     ZIP64_LIMIT, 0)
+        return struct.pack('<4s4H2LH', b'PK\x05\x06', 0, 0, count, count,
+                           central_size, offset, 0)
@@ -0,0 +1,217 @@
+import asyncio
+import hashlib
+import os
+import re
+from os import path
+
+from .cache import LRUCache
+
+# a year, the longest max-age caches are expected to honour
+IMMUTABLE_CACHE_CONTROL = 'max-age=31536000, immutable'
+
+
+def hash_file(file_path, algorithm='sha256'):
+    """
+    hash a file's content along with the stats it was read at
+
+    :type file_path: str
+    :type algorithm: str
+    :return: ``(st_ino, st_mtime, st_size, hex digest)``
+    :rtype: Tuple[int, float, int, str]
+    """
+    h = hashlib.new(algorithm)
+    with open(file_path, 'rb') as f:
+        r = os.fstat(f.fileno())
+        while True:
+            b = f.read(1024 * 1024)
+            if not b:
+                break
+            h.update(b)
+    return r.st_ino, r.st_mtime, r.st_size, h.hexdigest()
+
+
+def hash_tree(root, algorithm='sha256', hidden=True):
+    """
+    ``hash_file`` every file under ``root``
+
+    :return: state of each file, keyed on its name relative to ``root``
+    :rtype: Dict[str, Tuple[int, float, int, str]]
+    """
+    states = {}
+    for dir_path, dir_names, file_names in os.walk(root):
+        if hidden:
+            dir_names[:] = [d for d in dir_names if not d.startswith('.')]
+        for name in file_names:
+            if hidden and name.startswith('.'):
+                continue
+            file_path = path.join(dir_path, name)
+            try:
+                state = hash_file(file_path, algorithm)
+            except OSError:
+                continue
+            rel = path.relpath(file_path, root).replace(path.sep, '/')
+            states[rel] = state
+    return states
+
+
+class Fingerprints(LRUCache):
+    """
+    content hashes of files under ``root``, for urls like
+    ``app.3f2a1c9e04b7.js`` which ``send`` serves as ``app.js`` with
+    ``Cache-Control: max-age=31536000, immutable`` and the hash as ETag.
+
+    Hashes are computed in ``executor``, all at once with ``build`` or
+    one by one when first needed, and kept with inode, mtime and size of
+    the file. A file found changed when it's sent is hashed again; use a
+    ``Watcher`` to learn about changes before that.
+    """
+
+    def __init__(self, root, prefix='/', length=12, algorithm='sha256',
+                 maxsize=64 * 1024, executor=None, hidden=True):
+        """
+        :param root: directory of assets
+        :type root: str
+        :param prefix: of urls given by ``url``
+        :type prefix: str
+        :param length: hex digits of hash in urls
+        :type length: int
+        :param algorithm: of ``hashlib``
+        :type algorithm: str
+        :param maxsize: files remembered
+        :type maxsize: int
+        :param executor: where files are hashed, can be a process pool
+        :type executor: Union[concurrent.futures.Executor, None]
+        :param hidden: leave out hidden files from ``build``
+        :type hidden: bool
+        """
+        super().__init__(maxsize=maxsize)
+        self.root = path.abspath(path.normpath(root))
+        self.prefix = prefix.rstrip('/') + '/'
+        self.length = length
+        self.algorithm = algorithm
+        self.executor = executor
+        self.hidden = hidden
+        self._pattern = re.compile(
+            r'^(.+)\.([0-9a-f]{%d})(\.[^./]+)?$' % length)
+        self._pending = {}
+
+    async def build(self):
+        """
+        hash every file under root
+        """
+        loop = asyncio.get_event_loop()
+        states = await loop.run_in_executor(
+            self.executor, hash_tree, self.root, self.algorithm, self.hidden)
+        for name, state in states.items():
+            self.set(name, state)
+
+    def invalidate(self, paths):
+        """
+        :param paths: absolute paths of changed files
+        :type paths: Iterable[str]
+        """
+        for p in paths:
+            if p.startswith(self.root + path.sep):
+                self.pop(p[len(self.root) + 1:].replace(path.sep, '/'))
+
+    async def digest(self, name):
+        """
+        :param name: relative to root, with ``/`` separators
+        :type name: str
+        :return: hex digest of its content, ``None`` if there is no such file
+        :rtype: Union[str, None]
+        """
+        state = self.get(name)
+        if state is not None:
+            return state[3]
+        task = self._pending.get(name)
+        if task is None:
+            task = asyncio.ensure_future(self._hash(name))
+            self._pending[name] = task
+            task.add_done_callback(lambda _: self._pending.pop(name, None))
+        state = await asyncio.shield(task)
+        return state[3] if state is not None else None
+
+    async def _hash(self, name):
+        loop = asyncio.get_event_loop()
+        try:
+            state = await loop.run_in_executor(
+                self.executor, hash_file,
+                path.join(self.root, *name.split('/')), self.algorithm)
+        except OSError:
+            return None
+        self.set(name, state)
+        return state
+
+    def fingerprint(self, name, digest):
+        """
+        :type name: str
+        :type digest: str
+        :return: ``name`` with ``digest`` before its extension
+        :rtype: str
+        """
+        head, sep, base = name.rpartition('/')
+        stem, dot, ext = base.rpartition('.')
+        if not stem:
+            stem, dot, ext = base, '', ''
+        return head + sep + stem + '.' + digest[:self.length] + dot + ext
+
+    def url(self, name):
+        """
+        fingerprinted url of ``name``, without waiting:
+        until it's hashed, ``name`` is returned unchanged
+        and hashing starts in background.
+
+        :param name: relative to root, with ``/`` separators
+        :type name: str
+        :rtype: str
+        """
+        name = name.lstrip('/')
+        state = self.get(name)
+        if state is None:
+            if name not in self._pending:
+                asyncio.ensure_future(self.digest(name))
+            return self.prefix + name
+        return self.prefix + self.fingerprint(name, state[3])
+
+    async def lookup(self, file_path):
+        """
+        the file named by a fingerprinted path, if its hash is current
+
+        :param file_path: absolute and normalized
+        :type file_path: str
+        :return: path of the file without hash, and its digest
+        :rtype: Union[Tuple[str, str], None]
+        """
+        if not file_path.startswith(self.root + path.sep):
+            return None
+        rel = file_path[len(self.root) + 1:].replace(path.sep, '/')
+        match = self._pattern.match(rel)
+        if match is None:
+            return None
+        stem, digest, ext = match.groups()
+        name = stem + (ext or '')
+        current = await self.digest(name)
+        if current is None or current[:self.length] != digest:
+            return None
+        return path.join(self.root, *name.split('/')), current
+
+    def check(self, file_path, stats):
+        """
+        whether the file sent for a fingerprinted path is still the one
+        which was hashed, forget its hash if not
+
+        :type file_path: str
+        :type stats: aiohttp_send.send.FileState
+        :rtype: bool
+        """
+        rel = file_path[len(self.root) + 1:].replace(path.sep, '/')
+        state = self._data.get(rel)
+        if state is None:
+            return False
+        st_ino, st_mtime, st_size, _ = state[1]
+        if (st_ino, st_mtime, st_size) == \
+                (stats.st_ino, stats.st_mtime, stats.st_size):
+            return True
+        self.pop(rel)
+        return False
@@ -0,0 +1,423 @@
+import asyncio
+import mmap
+import os
+import time
+from collections import OrderedDict
+from os import path
+
+import aiofiles.os
+
+
+class LRUCache:
+    """
+    size-bounded least recently used mapping.
+
+    entries older than ``ttl`` seconds are dropped on lookup,
+    ``hits`` and ``misses`` count lookups so you can see what it saves.
+    Each entry weighs ``sizeof(value)``, 1 by default,
+    and the total weight is kept under ``maxsize``.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        """
+        :type maxsize: int
+        :param ttl: seconds an entry stays valid, ``None`` for no limit
+        :type ttl: Union[float, None]
+        """
+        if maxsize <= 0:
+            raise ValueError('maxsize must be positive')
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.currsize = 0
+        self._data = OrderedDict()
+
+    def sizeof(self, value):
+        return 1
+
+    def _removed(self, value):
+        """
+        called with each value leaving the cache
+        """
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        try:
+            created, value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        if self.ttl is not None and time.monotonic() - created > self.ttl:
+            self.pop(key)
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        size = self.sizeof(value)
+        if size > self.maxsize:
+            return
+        self.pop(key)
+        self._data[key] = (time.monotonic(), value)
+        self.currsize += size
+        while self.currsize > self.maxsize:
+            _, (_, old) = self._data.popitem(last=False)
+            self.currsize -= self.sizeof(old)
+            self._removed(old)
+
+    def pop(self, key, default=None):
+        item = self._data.pop(key, None)
+        if item is None:
+            return default
+        self.currsize -= self.sizeof(item[1])
+        self._removed(item[1])
+        return item[1]
+
+    def clear(self):
+        values = [value for _, value in self._data.values()]
+        self._data.clear()
+        self.currsize = 0
+        for value in values:
+            self._removed(value)
+
+    def invalidate(self, paths):
+        """
+        drop entries of changed files
+
+        :param paths: absolute paths of files changed on disk
+        :type paths: Iterable[str]
+        """
+        for p in paths:
+            self.pop(p)
+
+    def _stale(self, key):
+        """
+        drop an entry ``get`` just returned, and count it as a miss
+        """
+        self.pop(key)
+        self.hits -= 1
+        self.misses += 1
+
+    def stats(self):
+        """
+        :return: counters of this cache
+        :rtype: dict
+        """
+        return {
+            'size': len(self._data),
+            'currsize': self.currsize,
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+class PathCache(LRUCache):
+    """
+    cache of paths resolved by ``send``.
+
+    keyed on the normalized path, the accepted encodings and the options
+    affecting resolution, stores the file found on disk. A hit costs one
+    ``stat`` of the resolved file instead of the whole probe chain, and
+    returns its fresh stats; a file whose mtime or size changed is a miss.
+    """
+
+    async def lookup(self, key, executor=None):
+        """
+        :param executor: where ``stat`` runs
+        :type executor: Union[concurrent.futures.Executor, None]
+        :return: resolved file path, its stats and encoding extension
+        :rtype: Union[Tuple[str, aiohttp_send.send.FileState, str], None]
+        """
+        resolved = self.get(key)
+        if resolved is None:
+            return None
+        file_path, stats, encoding_ext = resolved
+        try:
+            r = await aiofiles.os.stat(file_path, executor=executor)
+        except OSError:
+            r = None
+        if r is None or r.st_mtime != stats.st_mtime \
+                or r.st_size != stats.st_size:
+            self._stale(key)
+            return None
+        return file_path, type(stats).from_stat(r), encoding_ext
+
+    def invalidate(self, paths):
+        """
+        drop entries resolved to a changed file, and entries whose
+        resolution could change, like ``a`` when ``a.json`` or ``a.br``
+        appears or ``a/`` when ``a/index.html`` does.
+
+        :type paths: Iterable[str]
+        """
+        paths = set(paths)
+        stems = set()
+        for p in paths:
+            stems.add(p)
+            stems.add(path.dirname(p))
+            head, name = path.split(p)
+            while '.' in name:
+                name = name.rsplit('.', 1)[0]
+                stems.add(path.join(head, name))
+        for key, (_, (file_path, _, _)) in list(self._data.items()):
+            if file_path in paths or key[0] in stems:
+                self.pop(key)
+
+
+class ContentCache(LRUCache):
+    """
+    in-memory cache of small file bodies.
+
+    ``maxsize`` is the byte budget of all cached bodies, files larger than
+    ``max_entry_size`` are never cached. Entries are keyed on the resolved
+    file path and only served while its ``st_mtime`` and ``st_size`` match.
+    """
+
+    def __init__(self, maxsize=16 * 1024 * 1024, max_entry_size=64 * 1024,
+                 ttl=None):
+        """
+        :param maxsize: byte budget
+        :type maxsize: int
+        :type max_entry_size: int
+        :type ttl: Union[float, None]
+        """
+        super().__init__(maxsize=maxsize, ttl=ttl)
+        self.max_entry_size = max_entry_size
+
+    def sizeof(self, value):
+        return len(value[2])
+
+    def accept(self, stats):
+        """
+        :type stats: aiohttp_send.send.FileState
+        :rtype: bool
+        """
+        return stats.st_size <= self.max_entry_size
+
+    def get_body(self, file_path, stats):
+        """
+        :type file_path: str
+        :type stats: aiohttp_send.send.FileState
+        :rtype: Union[bytes, None]
+        """
+        entry = self.get(file_path)
+        if entry is None:
+            return None
+        st_mtime, st_size, body = entry
+        if st_mtime != stats.st_mtime or st_size != stats.st_size:
+            self._stale(file_path)
+            return None
+        return body
+
+    def set_body(self, file_path, stats, body):
+        """
+        :type file_path: str
+        :type stats: aiohttp_send.send.FileState
+        :type body: bytes
+        """
+        if len(body) == stats.st_size and self.accept(stats):
+            self.set(file_path, (stats.st_mtime, stats.st_size, body))
+
+
+class Descriptor:
+    """
+    an open file shared by concurrent responses, see ``DescriptorCache``
+    """
+    __slots__ = ('file', 'st_ino', 'st_mtime', 'refs', 'evicted')
+
+    def __init__(self, file, st_ino, st_mtime):
+        self.file = file
+        self.st_ino = st_ino
+        self.st_mtime = st_mtime
+        self.refs = 0
+        self.evicted = False
+
+
+class DescriptorCache(LRUCache):
+    """
+    open read-only files of large, frequently sent files.
+
+    keyed on the resolved path and validated against inode and mtime.
+    Responses share a file and only read it at explicit offsets
+    (``os.pread`` or ``sendfile``), and a file evicted while responses
+    still use it is closed when the last one releases it.
+    ``maxsize`` is the number of files kept open.
+    """
+
+    def __init__(self, maxsize=128, min_size=1024 * 1024, ttl=None):
+        """
+        :type maxsize: int
+        :param min_size: smaller files are opened per response
+        :type min_size: int
+        :type ttl: Union[float, None]
+        """
+        super().__init__(maxsize=maxsize, ttl=ttl)
+        self.min_size = min_size
+
+    def accept(self, stats):
+        """
+        :type stats: aiohttp_send.send.FileState
+        :rtype: bool
+        """
+        return hasattr(os, 'pread') and stats.st_size >= self.min_size
+
+    async def acquire(self, file_path, stats, executor=None):
+        """
+        :type file_path: str
+        :type stats: aiohttp_send.send.FileState
+        :type executor: Union[concurrent.futures.Executor, None]
+        :return: open file to be given back with ``release``,
+            ``None`` if file changed since ``stats`` were taken
+        :rtype: Union[Descriptor, None]
+        """
+        descriptor = self.get(file_path)
+        if descriptor is not None:
+            if descriptor.st_ino == stats.st_ino \
+                    and descriptor.st_mtime == stats.st_mtime:
+                descriptor.refs += 1
+                return descriptor
+            self._stale(file_path)
+        # send imports this module through assets
+        from .send import open_file
+        f = await open_file(file_path, 'rb', buffering=0, executor=executor)
+        r = os.fstat(f.fileno())
+        if r.st_ino != stats.st_ino or r.st_mtime != stats.st_mtime:
+            f.close()
+            return None
+        descriptor = Descriptor(f, r.st_ino, r.st_mtime)
+        descriptor.refs = 1
+        self.set(file_path, descriptor)
+        return descriptor
+
+    def release(self, descriptor):
+        """
+        :type descriptor: Descriptor
+        """
+        descriptor.refs -= 1
+        if descriptor.evicted and descriptor.refs == 0:
+            descriptor.file.close()
+
+    def _removed(self, descriptor):
+        descriptor.evicted = True
+        if descriptor.refs == 0:
+            descriptor.file.close()
+
+
+class Mapping:
+    """
+    a memory-mapped file shared by concurrent responses, see ``MmapCache``
+    """
+    __slots__ = ('map', 'view', 'st_ino', 'st_mtime', 'refs', 'evicted')
+
+    def __init__(self, map, st_ino, st_mtime):
+        self.map = map
+        self.view = memoryview(map)
+        self.st_ino = st_ino
+        self.st_mtime = st_mtime
+        self.refs = 0
+        self.evicted = False
+
+    def close(self):
+        self.view.release()
+        try:
+            self.map.close()
+        except BufferError:
+            # a transport still holds a slice,
+            # the mapping is unmapped when it's garbage collected
+            pass
+
+
+def _map_file(file_path):
+    with open(file_path, 'rb') as f:
+        r = os.fstat(f.fileno())
+        m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if hasattr(m, 'madvise'):
+        m.madvise(mmap.MADV_WILLNEED)
+    return m, r
+
+
+class MmapCache(LRUCache):
+    """
+    memory-mapped large files, so concurrent responses share the page
+    cache and write slices of the mapping without allocating chunks.
+
+    ``maxsize`` is the budget of mapped bytes, mappings are keyed on the
+    resolved path and validated against inode and mtime. Files must be
+    replaced (rename) rather than modified in place: reading a mapping of
+    a truncated file crashes the process. Pages not in page cache are read
+    when touched, on the event loop, so it suits read-heavy hot files.
+    """
+
+    def __init__(self, maxsize=1024 * 1024 * 1024, min_size=1024 * 1024,
+                 ttl=None):
+        """
+        :param maxsize: budget of mapped bytes
+        :type maxsize: int
+        :param min_size: smaller files are not mapped
+        :type min_size: int
+        :type ttl: Union[float, None]
+        """
+        super().__init__(maxsize=maxsize, ttl=ttl)
+        self.min_size = min_size
+
+    def sizeof(self, mapping):
+        return len(mapping.map)
+
+    def accept(self, stats):
+        """
+        :type stats: aiohttp_send.send.FileState
+        :rtype: bool
+        """
+        return self.min_size <= stats.st_size <= self.maxsize
+
+    async def acquire(self, file_path, stats, executor=None):
+        """
+        :type file_path: str
+        :type stats: aiohttp_send.send.FileState
+        :type executor: Union[concurrent.futures.Executor, None]
+        :return: mapping to be given back with ``release``,
+            ``None`` if file changed since ``stats`` were taken
+        :rtype: Union[Mapping, None]
+        """
+        mapping = self.get(file_path)
+        if mapping is not None:
+            if mapping.st_ino == stats.st_ino \
+                    and mapping.st_mtime == stats.st_mtime:
+                mapping.refs += 1
+                return mapping
+            self._stale(file_path)
+        loop = asyncio.get_event_loop()
+        try:
+            m, r = await loop.run_in_executor(executor, _map_file, file_path)
+        except (OSError, ValueError):
+            return None
+        mapping = Mapping(m, r.st_ino, r.st_mtime)
+        if r.st_ino != stats.st_ino or r.st_mtime != stats.st_mtime \
+                or len(m) != stats.st_size:
+            mapping.close()
+            return None
+        mapping.refs = 1
+        self.set(file_path, mapping)
+        return mapping
+
+    def release(self, mapping):
+        """
+        :type mapping: Mapping
+        """
+        mapping.refs -= 1
+        if mapping.evicted and mapping.refs == 0:
+            mapping.close()
+
+    def _removed(self, mapping):
+        mapping.evicted = True
+        if mapping.refs == 0:
+            mapping.close()
@@ -0,0 +1,101 @@
+class ChunkSize:
+    """
+    strategy choosing the size of each read when a file is streamed
+    in chunks instead of being sent with ``sendfile``.
+    """
+
+    def sizes(self, count):
+        """
+        :param count: bytes going to be sent, ``None`` if unknown
+        :type count: Union[int, None]
+        :return: size of each successive read
+        :rtype: Iterator[int]
+        """
+        raise NotImplementedError
+
+
+class FixedChunkSize(ChunkSize):
+    """
+    read ``step`` bytes at a time, the behaviour of an int ``read_step``
+    """
+
+    def __init__(self, step=1024 * 4):
+        step = int(step)
+        if step <= 0:
+            raise ValueError('chunk size must be positive')
+        self.step = step
+
+    def sizes(self, count):
+        while True:
+            yield self.step
+
+    def __repr__(self):
+        return 'FixedChunkSize({})'.format(self.step)
+
+
+class FileSizeChunkSize(ChunkSize):
+    """
+    pick one chunk size from the number of bytes to send,
+    so a file is read in about ``reads`` steps
+    bounded by ``minimum`` and ``maximum``.
+    """
+
+    def __init__(self, reads=64, minimum=1024 * 4, maximum=1024 * 1024):
+        if not 0 < minimum <= maximum:
+            raise ValueError('require 0 < minimum <= maximum')
+        if reads <= 0:
+            raise ValueError('reads must be positive')
+        self.reads = reads
+        self.minimum = minimum
+        self.maximum = maximum
+
+    def sizes(self, count):
+        if count is None:
+            step = self.maximum
+        else:
+            step = min(max(count // self.reads, self.minimum), self.maximum)
+        while True:
+            yield step
+
+    def __repr__(self):
+        return 'FileSizeChunkSize(reads={}, minimum={}, maximum={})'.format(
+            self.reads, self.minimum, self.maximum)
+
+
+class AdaptiveChunkSize(ChunkSize):
+    """
+    start with small reads so short files and slow clients cost little,
+    and multiply the chunk size by ``factor`` after each read
+    up to ``maximum`` for long transfers.
+    """
+
+    def __init__(self, start=1024 * 4, maximum=1024 * 256, factor=2):
+        if not 0 < start <= maximum:
+            raise ValueError('require 0 < start <= maximum')
+        if factor < 1:
+            raise ValueError('factor must be at least 1')
+        self.start = start
+        self.maximum = maximum
+        self.factor = factor
+
+    def sizes(self, count):
+        step = self.start
+        while True:
+            yield step
+            step = min(int(step * self.factor), self.maximum)
+
+    def __repr__(self):
+        return 'AdaptiveChunkSize(start={}, maximum={}, factor={})'.format(
+            self.start, self.maximum, self.factor)
+
+
+def as_chunk_size(read_step):
+    """
+    accept an int as well as a strategy for ``read_step`` option
+
+    :type read_step: Union[int, ChunkSize]
+    :rtype: ChunkSize
+    """
+    if isinstance(read_step, ChunkSize):
+        return read_step
+    return FixedChunkSize(read_step)
@@ -0,0 +1,277 @@
+import asyncio
+import gzip
+import hashlib
+import mimetypes
+import os
+import tempfile
+import time
+from os import path
+
+from .cache import LRUCache
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+# prefixes of content types worth compressing
+COMPRESSIBLE_TYPES = (
+    'text/',
+    'application/javascript',
+    'application/json',
+    'application/manifest+json',
+    'application/wasm',
+    'application/xml',
+    'application/xhtml+xml',
+    'image/svg+xml',
+    'image/x-icon',
+    'image/vnd.microsoft.icon',
+    'font/ttf',
+    'font/otf',
+)
+
+
+def compress_bytes(data, encoding, level):
+    """
+    :type data: bytes
+    :param encoding: ``'br'``, ``'zstd'`` or ``'gzip'``
+    :type encoding: str
+    :param level: compress level of the encoding
+    :type level: int
+    :rtype: bytes
+    """
+    if encoding == 'br':
+        return brotli.compress(data, quality=level)
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    return gzip.compress(data, compresslevel=level)
+
+
+def available_encodings():
+    """
+    codings this process can compress with
+    """
+    encodings = {'gzip'}
+    if brotli is not None:
+        encodings.add('br')
+    if zstandard is not None:
+        encodings.add('zstd')
+    return encodings
+
+
+def compress_file(file_path, encoding, level, cache_path=None):
+    """
+    read and compress a file, reusing or filling ``cache_path`` on disk
+
+    :type file_path: str
+    :type encoding: str
+    :type level: int
+    :type cache_path: Union[str, None]
+    :rtype: bytes
+    """
+    if cache_path:
+        try:
+            with open(cache_path, 'rb') as f:
+                body = f.read()
+            # recently used, for prune_directory
+            os.utime(cache_path)
+            return body
+        except OSError:
+            pass
+    with open(file_path, 'rb') as f:
+        body = compress_bytes(f.read(), encoding, level)
+    if cache_path:
+        # unique name, concurrent calls for the same file may race here
+        fd, tmp = tempfile.mkstemp(suffix='.tmp',
+                                   dir=path.dirname(cache_path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(body)
+            os.replace(tmp, cache_path)
+        except OSError:
+            # another call won, or the disk is full: body is still good
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+    return body
+
+
+# temporary files older than this were left by a crashed process
+STALE_TMP_AGE = 3600
+
+
+def prune_directory(directory, maxsize):
+    """
+    remove least recently used files of an on-disk variant cache
+    until it holds at most ``maxsize`` bytes
+
+    :type directory: str
+    :type maxsize: int
+    :return: bytes removed
+    :rtype: int
+    """
+    now = time.time()
+    entries = []
+    removed = 0
+    with os.scandir(directory) as it:
+        for entry in it:
+            try:
+                r = entry.stat()
+            except OSError:
+                continue
+            if entry.name.endswith('.tmp'):
+                if now - r.st_mtime > STALE_TMP_AGE:
+                    try:
+                        os.remove(entry.path)
+                        removed += r.st_size
+                    except OSError:
+                        pass
+                continue
+            entries.append((r.st_mtime, r.st_size, entry.path))
+    entries.sort(reverse=True)
+    total = 0
+    for st_mtime, st_size, file_path in entries:
+        total += st_size
+        if total > maxsize:
+            try:
+                os.remove(file_path)
+                removed += st_size
+            except OSError:
+                pass
+    return removed
+
+
+class _VariantCache(LRUCache):
+    def sizeof(self, value):
+        return len(value[2])
+
+    def invalidate(self, paths):
+        paths = set(paths)
+        for key in list(self._data):
+            if key[0] in paths:
+                self.pop(key)
+
+
+class Compressor:
+    """
+    compress responses on the fly when no precompressed sibling exists.
+
+    compressed bodies are kept in memory within a budget of ``maxsize``
+    bytes, and in ``directory`` on disk if given, keyed on path, mtime,
+    size and encoding, so a file is only compressed once per change.
+    Least recently used files of ``directory`` are removed when it holds
+    more than ``directory_maxsize`` bytes, which drops variants of old
+    versions of files after a deploy.
+    """
+
+    def __init__(self, maxsize=64 * 1024 * 1024, min_size=1024,
+                 max_size=8 * 1024 * 1024, types=COMPRESSIBLE_TYPES,
+                 directory=None, executor=None, brotli_quality=5,
+                 gzip_level=6, zstd_level=10,
+                 directory_maxsize=256 * 1024 * 1024):
+        """
+        :param maxsize: byte budget of compressed bodies kept in memory
+        :type maxsize: int
+        :param min_size: smaller files are sent as they are
+        :type min_size: int
+        :param max_size: larger files are sent as they are
+        :type max_size: int
+        :param types: content type prefixes worth compressing
+        :type types: Tuple[str]
+        :param directory: where to keep compressed files on disk
+        :type directory: Union[str, None]
+        :param executor: where compression runs, can be a process pool,
+            ``None`` for loop's default executor
+        :type executor: Union[concurrent.futures.Executor, None]
+        :type brotli_quality: int
+        :type gzip_level: int
+        :type zstd_level: int
+        :param directory_maxsize: byte budget of ``directory``,
+            ``None`` to let it grow without limit
+        :type directory_maxsize: Union[int, None]
+        """
+        self.cache = _VariantCache(maxsize=maxsize)
+        self.min_size = min_size
+        self.max_size = max_size
+        self.types = tuple(types)
+        self.directory = directory
+        self.executor = executor
+        self.levels = {'br': brotli_quality, 'gzip': gzip_level,
+                       'zstd': zstd_level}
+        self.encodings = available_encodings()
+        self.directory_maxsize = directory_maxsize
+        # prune on first compression, left over files of previous runs
+        self._unpruned = directory_maxsize or 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def choose(self, file_path, stats, encoding_class):
+        """
+        :type file_path: str
+        :type stats: aiohttp_send.send.FileState
+        :param encoding_class: acceptable content codings, best first
+        :type encoding_class: Tuple[str]
+        :return: encoding to compress with, ``None`` to send file as it is
+        :rtype: Union[str, None]
+        """
+        if not self.min_size <= stats.st_size <= self.max_size:
+            return None
+        t, encoding = mimetypes.guess_type(file_path)
+        if encoding or not t or not t.startswith(self.types):
+            return None
+        for coding in encoding_class:
+            if coding in self.encodings:
+                return coding
+        return None
+
+    def invalidate(self, paths):
+        """
+        forget compressed bodies of changed files
+
+        :type paths: Iterable[str]
+        """
+        self.cache.invalidate(paths)
+
+    def clear(self):
+        self.cache.clear()
+
+    async def compress(self, file_path, stats, encoding):
+        """
+        :type file_path: str
+        :type stats: aiohttp_send.send.FileState
+        :type encoding: str
+        :return: compressed content of file
+        :rtype: bytes
+        """
+        key = (file_path, encoding)
+        entry = self.cache.get(key)
+        if entry is not None:
+            st_mtime, st_size, body = entry
+            if st_mtime == stats.st_mtime and st_size == stats.st_size:
+                return body
+            self.cache._stale(key)
+        cache_path = None
+        if self.directory:
+            digest = hashlib.sha1('{}:{}:{}:{}'.format(
+                file_path, stats.st_mtime, stats.st_size, encoding
+            ).encode('utf-8')).hexdigest()
+            cache_path = path.join(self.directory, digest + '.' + encoding)
+        loop = asyncio.get_event_loop()
+        body = await loop.run_in_executor(
+            self.executor, compress_file,
+            file_path, encoding, self.levels[encoding], cache_path)
+        self.cache.set(key, (stats.st_mtime, stats.st_size, body))
+        if cache_path and self.directory_maxsize is not None:
+            self._unpruned += len(body)
+            if self._unpruned >= self.directory_maxsize // 8:
+                self._unpruned = 0
+                await loop.run_in_executor(
+                    self.executor, prune_directory, self.directory,
+                    self.directory_maxsize)
+        return body
@@ -0,0 +1,72 @@
+import asyncio
+
+from aiohttp import web
+
+
+class SingleFlight:
+    """
+    concurrent calls with the same key share one call in flight,
+    so a burst of requests for the same file resolves, reads or
+    compresses it once.
+
+    The shared call isn't cancelled with the request which started it,
+    its result or exception is given to every caller waiting for it.
+    Callers waiting more than ``timeout`` seconds fail with
+    ``503 Service Unavailable``, the call goes on for later ones.
+    """
+
+    def __init__(self, timeout=None):
+        """
+        :param timeout: seconds a caller waits, ``None`` for no limit
+        :type timeout: Union[float, None]
+        """
+        self.timeout = timeout
+        self.calls = 0
+        self.shared = 0
+        self._flights = {}
+
+    def __len__(self):
+        return len(self._flights)
+
+    async def do(self, key, func, *args, **kwargs):
+        """
+        ``await func(*args, **kwargs)``, or wait for the call
+        with the same ``key`` already in flight
+
+        :type key: Hashable
+        :type func: Callable[..., Awaitable]
+        :raise web.HTTPServiceUnavailable: after waiting ``timeout``
+        """
+        task = self._flights.get(key)
+        if task is None:
+            self.calls += 1
+            task = asyncio.ensure_future(func(*args, **kwargs))
+            self._flights[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        else:
+            self.shared += 1
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), self.timeout)
+        except asyncio.TimeoutError:
+            if task.done():
+                raise
+            raise web.HTTPServiceUnavailable()
+
+    def _done(self, key, task):
+        if self._flights.get(key) is task:
+            del self._flights[key]
+        if not task.cancelled():
+            # retrieved, even when every caller gave up waiting
+            task.exception()
+
+    def stats(self):
+        """
+        :return: calls made, calls which joined one in flight,
+            and calls in flight
+        :rtype: dict
+        """
+        return {
+            'calls': self.calls,
+            'shared': self.shared,
+            'in_flight': len(self._flights),
+        }
@@ -0,0 +1,198 @@
+import asyncio
+import html
+import json
+import os
+import time
+from os import path
+from urllib.parse import quote
+
+from aiohttp import web
+
+from .cache import LRUCache
+from .send import to_UTC_string
+
+
+def scan_directory(dir_path, hidden=True):
+    """
+    entries of a directory in one ``os.scandir`` pass,
+    directories first, then by name
+
+    :type dir_path: str
+    :param hidden: leave out names starting with ``.``
+    :type hidden: bool
+    :return: name, whether it's a directory, size and mtime of each entry
+    :rtype: List[Tuple[str, bool, int, float]]
+    """
+    entries = []
+    with os.scandir(dir_path) as it:
+        for entry in it:
+            if hidden and entry.name.startswith('.'):
+                continue
+            try:
+                r = entry.stat()
+                is_dir = entry.is_dir()
+            except OSError:
+                continue
+            entries.append((entry.name, is_dir,
+                            0 if is_dir else r.st_size, r.st_mtime))
+    entries.sort(key=lambda e: (not e[1], e[0]))
+    return entries
+
+
+class DirectoryListing(LRUCache):
+    """
+    listings of directories without index, sent by ``send``
+    as html or json.
+
+    Entries are cached keyed on the directory and only used while its
+    mtime and inode match. A directory mtime changes when entries are
+    added, removed or renamed, not when a file is written in place, so
+    sizes and mtimes shown may lag behind until then.
+    Responses are written ``page_size`` entries at a time.
+    """
+
+    def __init__(self, maxsize=1024 * 1024, ttl=None, page_size=1000,
+                 output='auto'):
+        """
+        :param maxsize: budget of cached entries of all directories
+        :type maxsize: int
+        :type ttl: Union[float, None]
+        :param page_size: entries rendered and written at a time
+        :type page_size: int
+        :param output: ``html``, ``json``, or ``auto`` to send json
+            when client accepts it and not html
+        :type output: str
+        """
+        super().__init__(maxsize=maxsize, ttl=ttl)
+        if output not in ('auto', 'html', 'json'):
+            raise ValueError('output must be one of auto, html, json')
+        self.page_size = page_size
+        self.output = output
+
+    def sizeof(self, value):
+        return len(value[3]) + 1
+
+    def invalidate(self, paths):
+        """
+        drop listings of changed files' directories
+
+        :type paths: Iterable[str]
+        """
+        for p in paths:
+            self.pop(p)
+            self.pop(path.dirname(p))
+
+    async def entries(self, dir_path, stats, hidden=True, executor=None):
+        """
+        :type dir_path: str
+        :type stats: aiohttp_send.send.FileState
+        :type hidden: bool
+        :type executor: Union[concurrent.futures.Executor, None]
+        :rtype: List[Tuple[str, bool, int, float]]
+        """
+        cached = self.get(dir_path)
+        if cached is not None:
+            if cached[:3] == (stats.st_mtime, stats.st_ino, hidden):
+                return cached[3]
+            self._stale(dir_path)
+        loop = asyncio.get_event_loop()
+        entries = await loop.run_in_executor(executor, scan_directory,
+                                             dir_path, hidden)
+        self.set(dir_path, (stats.st_mtime, stats.st_ino, hidden, entries))
+        return entries
+
+    def wants_json(self, request):
+        """
+        :type request: web.Request
+        :rtype: bool
+        """
+        if self.output != 'auto':
+            return self.output == 'json'
+        accept = request.headers.get('Accept', '')
+        return 'application/json' in accept and 'text/html' not in accept
+
+    def variant(self, request, hidden=True):
+        """
+        ETag suffix of the listing sent, listings of a directory differ
+        by format and by the entries left out
+
+        :type request: web.Request
+        :type hidden: bool
+        :rtype: str
+        """
+        return ('-json' if self.wants_json(request) else '-html') + \
+            ('' if hidden else '-all')
+
+    async def respond(self, request, dir_path, stats, headers, hidden=True,
+                      executor=None, observer=None):
+        """
+        :type request: web.Request
+        :type dir_path: str
+        :type stats: aiohttp_send.send.FileState
+        :param headers: computed by ``send``, like ``ETag``
+        :type headers: multidict.CIMultiDict
+        :type hidden: bool
+        :type executor: Union[concurrent.futures.Executor, None]
+        :param observer: notified of the listing sent
+        :type observer: Union[aiohttp_send.Observer, None]
+        :rtype: web.StreamResponse
+        """
+        entries = await self.entries(dir_path, stats, hidden=hidden,
+                                     executor=executor)
+        as_json = self.wants_json(request)
+        headers['Content-Type'] = 'application/json' if as_json \
+            else 'text/html; charset=utf-8'
+        resp = web.StreamResponse(headers=headers)
+        await resp.prepare(request)
+        started = time.perf_counter()
+        size = 0
+        if request.method != 'HEAD':
+            render = self._json_page if as_json else self._html_page
+            head = b'[' if as_json else self._html_head(request.path)
+            await resp.write(head)
+            size += len(head)
+            for start in range(0, len(entries), self.page_size):
+                page = render(request.path,
+                              entries[start:start + self.page_size], start)
+                await resp.write(page)
+                size += len(page)
+            end = b']' if as_json else b'</ul>\n</body>\n</html>\n'
+            await resp.write(end)
+            size += len(end)
+        if observer is not None:
+            observer.sent(request, 200, 'identity', size,
+                          time.perf_counter() - started)
+        return resp
+
+    def _json_page(self, url_path, entries, start):
+        page = ','.join(json.dumps({
+            'name': name,
+            'type': 'directory' if is_dir else 'file',
+            'size': size,
+            'mtime': to_UTC_string(mtime),
+        }) for name, is_dir, size, mtime in entries)
+        return (',' + page if start else page).encode('utf-8')
+
+    def _html_head(self, url_path):
+        title = html.escape('Index of ' + url_path)
+        head = ('<!DOCTYPE html>\n<html>\n<head><meta charset="utf-8">'
+                '<title>{0}</title></head>\n<body>\n<h1>{0}</h1>\n<ul>\n'
+                .format(title))
+        if url_path.rstrip('/'):
+            head += '<li><a href="{}">../</a></li>\n'.format(
+                '../' if url_path.endswith('/') else './')
+        return head.encode('utf-8')
+
+    def _html_page(self, url_path, entries, start):
+        # links relative to the directory, even without trailing slash
+        base = '' if url_path.endswith('/') \
+            else url_path.rsplit('/', 1)[-1] + '/'
+        lines = []
+        for name, is_dir, size, mtime in entries:
+            if is_dir:
+                name += '/'
+            href = quote(base + name, errors='surrogateescape')
+            lines.append('<li><a href="{}">{}</a> {} {}</li>\n'.format(
+                html.escape(href), html.escape(name),
+                '-' if is_dir else size, to_UTC_string(mtime)))
+        return ''.join(lines).encode('utf-8', 'surrogateescape')
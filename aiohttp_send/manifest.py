@@ -0,0 +1,177 @@
+import asyncio
+import json
+import os
+from os import path
+
+from .negotiation import ENCODINGS
+from .send import FileState, file_type, normalize_extensions
+
+
+class Manifest:
+    """
+    every servable file under a root, scanned once.
+
+    ``send`` given a manifest resolves paths, precompressed siblings,
+    ``extensions`` and ``index`` with dictionary lookups instead of
+    touching the filesystem, unknown paths are 404 for free.
+    Only suitable when files under root don't change while serving.
+    """
+
+    def __init__(self, root, files, aliases=None):
+        """
+        :param root: directory paths are relative to
+        :type root: str
+        :param files: stats of each file, keyed on path relative to root
+        :type files: Dict[str, FileState]
+        :param aliases: path served in place of another one,
+            for ``extensions`` and ``index``
+        :type aliases: Dict[str, str]
+        """
+        self.root = path.abspath(path.normpath(root))
+        self.files = files
+        self.aliases = aliases or {}
+
+    def __len__(self):
+        return len(self.files)
+
+    @classmethod
+    def scan(cls, root, index='', extensions=None, hidden=True):
+        """
+        walk ``root`` and record every file.
+        blocks, use ``build`` from a running loop.
+
+        :type root: str
+        :param index: file served for a directory
+        :type index: str
+        :param extensions: extensions tried for paths without one
+        :type extensions: List[str]
+        :param hidden: skip hidden files and directories
+        :type hidden: bool
+        :rtype: Manifest
+        """
+        root = path.abspath(path.normpath(root))
+        files = {}
+        directories = []
+        for dir_path, dir_names, file_names in os.walk(root):
+            rel_dir = path.relpath(dir_path, root)
+            rel_dir = '' if rel_dir == '.' else rel_dir
+            if hidden:
+                dir_names[:] = [d for d in dir_names if not d.startswith('.')]
+            directories.append(rel_dir)
+            for name in file_names:
+                if hidden and name.startswith('.'):
+                    continue
+                rel = path.join(rel_dir, name)
+                try:
+                    r = os.stat(path.join(dir_path, name))
+                except OSError:
+                    continue
+                files[rel] = FileState.from_stat(r)
+
+        aliases = {}
+        if index:
+            for rel_dir in directories:
+                target = path.join(rel_dir, index)
+                if target in files:
+                    aliases[rel_dir] = target
+        for ext in normalize_extensions(extensions) or ():
+            for rel in files:
+                if not rel.endswith(ext):
+                    continue
+                stem = rel[:-len(ext)]
+                if '.' in path.basename(stem) or stem in files:
+                    continue
+                aliases.setdefault(stem, rel)
+        return cls(root, files, aliases)
+
+    @classmethod
+    async def build(cls, root, index='', extensions=None, hidden=True,
+                    executor=None):
+        """
+        ``scan`` in an executor
+
+        :rtype: Manifest
+        """
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            executor, cls.scan, root, index, extensions, hidden)
+
+    def resolve(self, file_path, encoding_class=()):
+        """
+        :param file_path: absolute normalized path under root
+        :type file_path: str
+        :param encoding_class: acceptable content codings, best first
+        :type encoding_class: Tuple[str]
+        :return: resolved file path, its stats and encoding extension
+        :rtype: Union[Tuple[str, FileState, str], None]
+        """
+        if file_path == self.root:
+            rel = ''
+        elif file_path.startswith(self.root + path.sep):
+            rel = file_path[len(self.root) + 1:]
+        else:
+            return None
+        if rel not in self.files:
+            rel = self.aliases.get(rel)
+            if rel is None:
+                return None
+        for coding in encoding_class:
+            ext = ENCODINGS[coding]
+            stats = self.files.get(rel + ext)
+            if stats is not None:
+                return path.join(self.root, rel + ext), stats, ext
+        return path.join(self.root, rel), self.files[rel], ''
+
+    def to_dict(self):
+        """
+        :return: json serializable form of manifest
+        :rtype: dict
+        """
+        files = {}
+        for rel, stats in self.files.items():
+            files[rel.replace(path.sep, '/')] = {
+                'mtime': stats.st_mtime,
+                'size': stats.st_size,
+                'ino': stats.st_ino,
+                'etag': stats.etag,
+                'type': file_type(rel, ''),
+            }
+        aliases = {k.replace(path.sep, '/'): v.replace(path.sep, '/')
+                   for k, v in self.aliases.items()}
+        return {'files': files, 'aliases': aliases}
+
+    @classmethod
+    def from_dict(cls, root, data):
+        """
+        :type root: str
+        :param data: output of ``to_dict``
+        :type data: dict
+        :rtype: Manifest
+        """
+        files = {}
+        for rel, item in data['files'].items():
+            files[rel.replace('/', path.sep)] = FileState(
+                st_mtime=item['mtime'], st_size=item['size'],
+                is_directory=False, st_ino=item['ino'])
+        aliases = {k.replace('/', path.sep): v.replace('/', path.sep)
+                   for k, v in data.get('aliases', {}).items()}
+        return cls(root, files, aliases)
+
+    def dump(self, file_path):
+        """
+        write manifest to a json file, to be ``load``-ed at startup
+        """
+        with open(file_path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, indent=1, sort_keys=True)
+
+    @classmethod
+    def load(cls, file_path, root):
+        """
+        :param file_path: json file written by ``dump``
+        :type file_path: str
+        :param root: directory the manifest describes
+        :type root: str
+        :rtype: Manifest
+        """
+        with open(file_path, encoding='utf-8') as f:
+            return cls.from_dict(root, json.load(f))
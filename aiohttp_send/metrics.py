@@ -0,0 +1,205 @@
+from aiohttp import web
+
+
+class Observer:
+    """
+    hooks called by ``send`` while serving a request, does nothing.
+
+    Subclass it and override the hooks to collect metrics or traces,
+    or use ``Metrics``. Hooks are called on the event loop and
+    should return quickly.
+    """
+
+    def prepared(self, request, seconds):
+        """
+        path resolved and headers computed
+
+        :type request: web.Request
+        :param seconds: time spent resolving the file and its headers
+        :type seconds: float
+        """
+
+    def sent(self, request, status, encoding, size, seconds):
+        """
+        response body written
+
+        :type request: web.Request
+        :type status: int
+        :param encoding: content coding of the body, ``identity`` if none
+        :type encoding: str
+        :param size: bytes of the body
+        :type size: int
+        :param seconds: time spent streaming the body,
+            ``0`` for bodies held in memory, which are written by aiohttp
+        :type seconds: float
+        """
+
+    def failed(self, request, status):
+        """
+        request answered without a body, like 304, 403, 404 or 416
+
+        :type request: web.Request
+        :type status: int
+        """
+
+    def io(self, request, kind):
+        """
+        one executor job or zero-copy transfer made for the request
+
+        :type request: web.Request
+        :param kind: ``resolve``, ``open``, ``read`` or ``sendfile``
+        :type kind: str
+        """
+
+
+# upper bounds of latency histograms, in seconds
+DEFAULT_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5,
+                   1., 2.5, 5., 10.)
+
+
+class Histogram:
+    """
+    cumulative histogram of observed values
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.
+
+    def observe(self, value):
+        """
+        :type value: float
+        """
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+
+def _labels(**labels):
+    return '{' + ','.join(
+        '{}="{}"'.format(k, str(v).replace('\\', '\\\\')
+                         .replace('"', '\\"').replace('\n', '\\n'))
+        for k, v in labels.items()) + '}'
+
+
+class Metrics(Observer):
+    """
+    in-process collector of ``send`` metrics, with
+    Prometheus text exposition of them and of cache hit ratios.
+    """
+
+    def __init__(self, caches=None, buckets=DEFAULT_BUCKETS,
+                 prefix='aiohttp_send'):
+        """
+        :param caches: caches reported by name, like ``{'path': PathCache()}``
+        :type caches: Union[Dict[str, aiohttp_send.LRUCache], None]
+        :param buckets: upper bounds of latency histograms in seconds
+        :type buckets: Iterable[float]
+        :param prefix: of metric names
+        :type prefix: str
+        """
+        self.caches = dict(caches or {})
+        self.prefix = prefix
+        self.responses = {}
+        self.bytes_sent = {}
+        self.io_calls = {}
+        self.prepare_seconds = Histogram(buckets)
+        self.body_seconds = Histogram(buckets)
+
+    def prepared(self, request, seconds):
+        self.prepare_seconds.observe(seconds)
+
+    def sent(self, request, status, encoding, size, seconds):
+        self.responses[status] = self.responses.get(status, 0) + 1
+        self.bytes_sent[encoding] = self.bytes_sent.get(encoding, 0) + size
+        if seconds:
+            self.body_seconds.observe(seconds)
+
+    def failed(self, request, status):
+        self.responses[status] = self.responses.get(status, 0) + 1
+
+    def io(self, request, kind):
+        self.io_calls[kind] = self.io_calls.get(kind, 0) + 1
+
+    def stats(self):
+        """
+        :return: counters and hit ratio of each cache
+        :rtype: dict
+        """
+        caches = {}
+        for name, cache in self.caches.items():
+            s = cache.stats()
+            lookups = s['hits'] + s['misses']
+            s['hit_ratio'] = s['hits'] / lookups if lookups else 0.
+            caches[name] = s
+        return {
+            'responses': dict(self.responses),
+            'bytes_sent': dict(self.bytes_sent),
+            'io': dict(self.io_calls),
+            'caches': caches,
+        }
+
+    def exposition(self):
+        """
+        :return: metrics in Prometheus text format
+        :rtype: str
+        """
+        p = self.prefix
+        lines = []
+
+        def metric(name, kind, help, samples):
+            lines.append('# HELP {}_{} {}'.format(p, name, help))
+            lines.append('# TYPE {}_{} {}'.format(p, name, kind))
+            for suffix, labels, value in samples:
+                lines.append('{}_{}{}{} {}'.format(
+                    p, name, suffix, _labels(**labels) if labels else '',
+                    value))
+
+        def histogram(name, help, h):
+            samples = [('_bucket', {'le': repr(bound)}, count)
+                       for bound, count in zip(h.buckets, h.counts)]
+            samples.append(('_bucket', {'le': '+Inf'}, h.count))
+            samples.append(('_sum', None, h.sum))
+            samples.append(('_count', None, h.count))
+            metric(name, 'histogram', help, samples)
+
+        metric('responses_total', 'counter', 'Responses by status.',
+               [('', {'status': status}, count)
+                for status, count in sorted(self.responses.items())])
+        metric('sent_bytes_total', 'counter',
+               'Body bytes by content coding.',
+               [('', {'encoding': encoding}, size)
+                for encoding, size in sorted(self.bytes_sent.items())])
+        metric('io_total', 'counter',
+               'Executor jobs and zero-copy transfers by kind.',
+               [('', {'kind': kind}, count)
+                for kind, count in sorted(self.io_calls.items())])
+        histogram('prepare_seconds',
+                  'Time resolving files and computing headers.',
+                  self.prepare_seconds)
+        histogram('body_seconds', 'Time streaming response bodies.',
+                  self.body_seconds)
+        stats = self.stats()['caches']
+        for key, kind in (('hits', 'counter'), ('misses', 'counter'),
+                          ('currsize', 'gauge')):
+            name = 'cache_' + key + ('_total' if kind == 'counter' else '')
+            metric(name, kind, 'Cache {}.'.format(key),
+                   [('', {'cache': name_}, s[key])
+                    for name_, s in sorted(stats.items())])
+        return '\n'.join(lines) + '\n'
+
+    async def handler(self, request):
+        """
+        aiohttp handler serving ``exposition``,
+        like ``app.router.add_get('/metrics', metrics.handler)``
+
+        :type request: web.Request
+        :rtype: web.Response
+        """
+        return web.Response(
+            text=self.exposition(),
+            headers={'Content-Type': 'text/plain; version=0.0.4'})
@@ -0,0 +1,75 @@
+# precompressed sibling extension of each content coding,
+# in order of server preference
+ENCODINGS = {
+    'br': '.br',
+    'zstd': '.zst',
+    'gzip': '.gz',
+}
+
+
+def parse_accept_encoding(header):
+    """
+    parse ``Accept-Encoding`` header into q-value of each coding
+
+    :type header: str
+    :rtype: Dict[str, float]
+    """
+    codings = {}
+    for item in header.split(','):
+        coding, _, params = item.partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        codings[coding] = max(0.0, min(q, 1.0))
+    return codings
+
+
+def negotiate_encoding(header, available):
+    """
+    acceptable codings among ``available``, best first.
+
+    codings are ordered by client q-value, ties by order of ``available``,
+    ``*`` applies to codings not listed and ``q=0`` excludes a coding.
+
+    :param header: value of ``Accept-Encoding``, may be empty
+    :type header: str
+    :param available: codings server can send, preferred first
+    :type available: Iterable[str]
+    :rtype: Tuple[str]
+    """
+    if not header:
+        return ()
+    codings = parse_accept_encoding(header)
+    default = codings.get('*', 0.0)
+    ranked = []
+    for preference, coding in enumerate(available):
+        q = codings.get(coding, default)
+        if q > 0:
+            ranked.append((-q, preference, coding))
+    ranked.sort()
+    return tuple(coding for _, _, coding in ranked)
+
+
+def identity_acceptable(header):
+    """
+    whether the file may be sent without content coding,
+    ``identity;q=0``, or ``*;q=0`` without ``identity``, refuse it.
+
+    :param header: value of ``Accept-Encoding``, may be empty
+    :type header: str
+    :rtype: bool
+    """
+    if 'identity' not in header and '*' not in header:
+        return True
+    codings = parse_accept_encoding(header)
+    if 'identity' in codings:
+        return codings['identity'] > 0
+    return codings.get('*', 1.0) > 0
@@ -0,0 +1,106 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+
+
+class IOPool:
+    """
+    dedicated executor for file I/O of ``send``, and a cap on files
+    being sent at the same time.
+
+    Requests over ``max_streams`` wait in a queue, when ``max_queue``
+    requests are already waiting or one waited ``timeout`` seconds
+    they fail fast with ``503 Service Unavailable``.
+    """
+
+    def __init__(self, max_workers=8, executor=None, max_streams=None,
+                 max_queue=None, timeout=None):
+        """
+        :param max_workers: threads of the executor created
+            when ``executor`` isn't given,
+            ``None`` to use loop's default executor
+        :type max_workers: Union[int, None]
+        :type executor: Union[concurrent.futures.Executor, None]
+        :param max_streams: files sent at the same time, ``None`` for no limit
+        :type max_streams: Union[int, None]
+        :param max_queue: requests waiting for a stream,
+            ``None`` for no limit, ``0`` to fail at once
+        :type max_queue: Union[int, None]
+        :param timeout: seconds a request waits for a stream
+        :type timeout: Union[float, None]
+        """
+        self._own_executor = executor is None and max_workers is not None
+        if self._own_executor:
+            executor = ThreadPoolExecutor(max_workers)
+        self.executor = executor
+        self.max_streams = max_streams
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+        self._semaphore = None
+
+    def stats(self):
+        """
+        :return: current load, ``waiting`` is the queue depth
+        :rtype: dict
+        """
+        return {
+            'active': self.active,
+            'waiting': self.waiting,
+            'rejected': self.rejected,
+            'max_streams': self.max_streams,
+            'max_queue': self.max_queue,
+        }
+
+    async def acquire(self):
+        """
+        wait for a free stream
+
+        :raise web.HTTPServiceUnavailable: when saturated
+        """
+        if self.max_streams is not None:
+            if self._semaphore is None:
+                self._semaphore = asyncio.Semaphore(self.max_streams)
+            if self._semaphore.locked():
+                if self.max_queue is not None \
+                        and self.waiting >= self.max_queue:
+                    self.rejected += 1
+                    raise web.HTTPServiceUnavailable()
+                self.waiting += 1
+                try:
+                    await asyncio.wait_for(self._semaphore.acquire(),
+                                           self.timeout)
+                except asyncio.TimeoutError:
+                    self.rejected += 1
+                    raise web.HTTPServiceUnavailable()
+                finally:
+                    self.waiting -= 1
+            else:
+                await self._semaphore.acquire()
+        self.active += 1
+
+    def release(self):
+        self.active -= 1
+        if self._semaphore is not None:
+            self._semaphore.release()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+
+    def close(self):
+        """
+        shut down the executor if it was created by the pool
+        """
+        if self._own_executor:
+            self.executor.shutdown(wait=False)
+
+
+# used by ``send`` when no pool is given
+DEFAULT_POOL = IOPool(max_workers=None)
@@ -0,0 +1,192 @@
+"""
+write ``.br``, ``.gz`` and ``.zst`` siblings of compressible files under
+a root at maximum levels, for ``send`` to serve instead of the originals.
+
+    python -m aiohttp_send.precompress public --manifest public.json
+"""
+import argparse
+import mimetypes
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from os import path
+
+from .compress import COMPRESSIBLE_TYPES, available_encodings, compress_bytes
+from .manifest import Manifest
+from .negotiation import ENCODINGS
+
+# best ratio of each coding, zstd levels above 19 need much more memory
+MAX_LEVELS = {'br': 11, 'zstd': 19, 'gzip': 9}
+
+VARIANT_EXTENSIONS = tuple(ENCODINGS.values())
+
+
+def is_compressible(file_path, types=COMPRESSIBLE_TYPES):
+    """
+    :type file_path: str
+    :param types: prefixes of compressible content types
+    :type types: Tuple[str]
+    :rtype: bool
+    """
+    t, encoding = mimetypes.guess_type(file_path)
+    return not encoding and bool(t) and t.startswith(types)
+
+
+def precompress_file(file_path, encodings, levels=None):
+    """
+    write compressed siblings of a file which are missing or older than it,
+    and remove those which aren't smaller than it
+
+    :type file_path: str
+    :param encodings: codings to write, like ``['br', 'gzip']``
+    :type encodings: Iterable[str]
+    :param levels: compress level of each coding, maximum by default
+    :type levels: Union[Dict[str, int], None]
+    :return: how many variants were ``written``, ``fresh`` or ``dropped``
+    :rtype: Dict[str, int]
+    """
+    levels = dict(MAX_LEVELS, **(levels or {}))
+    counts = {'written': 0, 'fresh': 0, 'dropped': 0}
+    r = os.stat(file_path)
+    data = None
+    for encoding in encodings:
+        variant = file_path + ENCODINGS[encoding]
+        try:
+            if os.stat(variant).st_mtime >= r.st_mtime:
+                counts['fresh'] += 1
+                continue
+        except OSError:
+            pass
+        if data is None:
+            with open(file_path, 'rb') as f:
+                data = f.read()
+        body = compress_bytes(data, encoding, levels[encoding])
+        if len(body) >= len(data):
+            try:
+                os.remove(variant)
+            except OSError:
+                pass
+            counts['dropped'] += 1
+            continue
+        tmp = '{}.{}.tmp'.format(variant, os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write(body)
+        # same mtime as the original, so a change of it makes variant stale
+        os.utime(tmp, ns=(r.st_atime_ns, r.st_mtime_ns))
+        os.replace(tmp, variant)
+        counts['written'] += 1
+    return counts
+
+
+def find_files(root, types=COMPRESSIBLE_TYPES, min_size=256, hidden=True):
+    """
+    compressible files under ``root``, leaving out variants
+
+    :type root: str
+    :type types: Tuple[str]
+    :param min_size: smaller files aren't worth it
+    :type min_size: int
+    :param hidden: leave out hidden files and directories
+    :type hidden: bool
+    :rtype: List[str]
+    """
+    files = []
+    for dir_path, dir_names, file_names in os.walk(root):
+        if hidden:
+            dir_names[:] = [d for d in dir_names if not d.startswith('.')]
+        for name in file_names:
+            if hidden and name.startswith('.') \
+                    or name.endswith(VARIANT_EXTENSIONS) \
+                    or not is_compressible(name, types):
+                continue
+            file_path = path.join(dir_path, name)
+            try:
+                if os.stat(file_path).st_size < min_size:
+                    continue
+            except OSError:
+                continue
+            files.append(file_path)
+    return files
+
+
+def precompress(root, encodings=None, levels=None, types=COMPRESSIBLE_TYPES,
+                min_size=256, hidden=True, workers=None, manifest=None,
+                index='', extensions=None):
+    """
+    precompress every compressible file under ``root`` in a process pool
+
+    :type root: str
+    :param encodings: defaults to every available coding
+    :type encodings: Union[Iterable[str], None]
+    :type levels: Union[Dict[str, int], None]
+    :type types: Tuple[str]
+    :type min_size: int
+    :type hidden: bool
+    :param workers: processes, defaults to number of cpus
+    :type workers: Union[int, None]
+    :param manifest: write a ``Manifest`` of root to this json file
+    :type manifest: Union[str, None]
+    :param index: of the manifest
+    :type index: str
+    :param extensions: of the manifest
+    :type extensions: Union[List[str], None]
+    :return: files found and variants ``written``, ``fresh`` or ``dropped``
+    :rtype: Dict[str, int]
+    """
+    available = available_encodings()
+    if encodings is None:
+        encodings = available
+    missing = set(encodings) - available
+    if missing:
+        raise ValueError('can\'t compress with ' + ', '.join(sorted(missing)))
+    encodings = [coding for coding in ENCODINGS if coding in encodings]
+    files = find_files(root, types, min_size, hidden)
+    totals = {'files': len(files), 'written': 0, 'fresh': 0, 'dropped': 0}
+    # workers get the function and its arguments pickled, so whatever
+    # runs in a pool, here or as an executor of Compressor or Fingerprints,
+    # is a module level function taking plain values
+    with ProcessPoolExecutor(workers) as executor:
+        for counts in executor.map(precompress_file, files,
+                                   [encodings] * len(files),
+                                   [levels] * len(files), chunksize=16):
+            for key, value in counts.items():
+                totals[key] += value
+    if manifest:
+        Manifest.scan(root, index, extensions, hidden).dump(manifest)
+    return totals
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m aiohttp_send.precompress', description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('root')
+    parser.add_argument('--encodings', nargs='+', choices=list(ENCODINGS),
+                        help='defaults to every available one')
+    parser.add_argument('--min-size', type=int, default=256,
+                        help='bytes, smaller files are left alone')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='processes, defaults to number of cpus')
+    parser.add_argument('--all', action='store_true',
+                        help='include hidden files and directories')
+    parser.add_argument('--manifest', help='write a manifest json file')
+    parser.add_argument('--index', default='', help='index of the manifest')
+    parser.add_argument('--extensions', nargs='+',
+                        help='extensions of the manifest')
+    args = parser.parse_args(argv)
+    if not path.isdir(args.root):
+        parser.error('{} is not a directory'.format(args.root))
+    try:
+        totals = precompress(args.root, encodings=args.encodings,
+                             min_size=args.min_size, hidden=not args.all,
+                             workers=args.workers, manifest=args.manifest,
+                             index=args.index, extensions=args.extensions)
+    except ValueError as e:
+        parser.error(str(e))
+    print('{files} files: {written} variants written, {fresh} up to date, '
+          '{dropped} dropped'.format(**totals))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
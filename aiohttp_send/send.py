@@ -1,8 +1,12 @@
+import asyncio
 import datetime
 import mimetypes
 import os
 import re
+import stat
+import time
 import types
+import uuid
 from os import path
 from os.path import splitdrive, normpath, join
 from typing import List
@@ -13,10 +17,23 @@ import aiofiles.os
 from aiohttp import web
 from multidict import CIMultiDict
 
+from .assets import IMMUTABLE_CACHE_CONTROL
+from .chunks import AdaptiveChunkSize, as_chunk_size
+from .negotiation import ENCODINGS, identity_acceptable, negotiate_encoding
+from .pool import DEFAULT_POOL
+
+DEFAULT_READ_STEP = AdaptiveChunkSize()
+
 
 async def send(request, file_path, root='', index='', immutable=False,
                max_age=0, hidden=True, format=True, brotli=True, gzip=True,
-               set_headers=None, extensions=None, read_step=1024 * 4, **kwargs):
+               zstd=True,
+               set_headers=None, extensions=None, read_step=DEFAULT_READ_STEP,
+               sendfile=True, cache=None, content_cache=None, etag=True,
+               ranges=True, compress=None, manifest=None, pool=None,
+               fd_cache=None, mmap_cache=None, observer=None, listing=None,
+               flight=None, fingerprints=None, small_size=0, throttle=None,
+               **kwargs):
     """
     :type max_age: int
     :type request: web.Request
@@ -28,174 +45,682 @@ async def send(request, file_path, root='', index='', immutable=False,
     :type format: bool
     :type brotli: bool
     :type gzip: bool
+    :type zstd: bool
     :type set_headers: Union[typing.Callable, None]
     :type extensions: List[str]
-    :type read_step: int
-    """
-    res = await _prepare(request,
-                         file_path=file_path,
-                         root=root,
-                         index=index,
-                         immutable=immutable,
-                         max_age=max_age,
-                         hidden=hidden,
-                         format=format,
-                         brotli=brotli,
-                         gzip=gzip,
-                         set_headers=set_headers,
-                         extensions=extensions,
-                         **kwargs)
+    :param read_step: bytes per read, or a strategy choosing it,
+        when file isn't sent with ``sendfile``
+    :type read_step: Union[int, aiohttp_send.ChunkSize]
+    :type sendfile: bool
+    :type cache: Union[aiohttp_send.PathCache, None]
+    :type content_cache: Union[aiohttp_send.ContentCache, None]
+    :type etag: bool
+    :type ranges: bool
+    :type compress: Union[aiohttp_send.Compressor, None]
+    :type manifest: Union[aiohttp_send.Manifest, None]
+    :param pool: executor for file I/O and limit of concurrent streams
+    :type pool: Union[aiohttp_send.IOPool, None]
+    :param fd_cache: keep large files open between responses
+    :type fd_cache: Union[aiohttp_send.DescriptorCache, None]
+    :param mmap_cache: write large files from shared memory mappings
+    :type mmap_cache: Union[aiohttp_send.MmapCache, None]
+    :param observer: notified of timings, I/O and outcome of the request
+    :type observer: Union[aiohttp_send.Observer, None]
+    :param listing: list directories without index instead of 404
+    :type listing: Union[aiohttp_send.DirectoryListing, None]
+    :param flight: share resolutions, reads and compressions
+        of concurrent requests for the same file
+    :type flight: Union[aiohttp_send.SingleFlight, None]
+    :param fingerprints: serve content-hashed urls as immutable
+    :type fingerprints: Union[aiohttp_send.Fingerprints, None]
+    :param small_size: files up to this size are read whole and sent
+        with their headers in one write, instead of being streamed
+    :type small_size: int
+    :param throttle: limit bandwidth of large files
+    :type throttle: Union[aiohttp_send.Throttle, None]
+    """
+    options = Options(root=root,
+                      index=index,
+                      immutable=immutable,
+                      max_age=max_age,
+                      hidden=hidden,
+                      format=format,
+                      brotli=brotli,
+                      gzip=gzip,
+                      zstd=zstd,
+                      set_headers=set_headers,
+                      extensions=extensions,
+                      read_step=read_step,
+                      sendfile=sendfile,
+                      cache=cache,
+                      content_cache=content_cache,
+                      etag=etag,
+                      ranges=ranges,
+                      compress=compress,
+                      manifest=manifest,
+                      pool=pool,
+                      fd_cache=fd_cache,
+                      mmap_cache=mmap_cache,
+                      observer=observer,
+                      listing=listing,
+                      flight=flight,
+                      fingerprints=fingerprints,
+                      small_size=small_size,
+                      throttle=throttle)
+    return await send_with(request, file_path, options)
+
+
+class Options:
+    """
+    options of ``send`` validated and normalized once,
+    so they can be reused by many requests with ``send_with``.
+    Arguments are the keyword arguments of ``send``.
+    """
+
+    def __init__(self, root='', index='', immutable=False, max_age=0,
+                 hidden=True, format=True, brotli=True, gzip=True, zstd=True,
+                 set_headers=None, extensions=None,
+                 read_step=DEFAULT_READ_STEP, sendfile=True, cache=None,
+                 content_cache=None, etag=True, ranges=True, compress=None,
+                 manifest=None, pool=None, fd_cache=None, mmap_cache=None,
+                 observer=None, listing=None, flight=None,
+                 fingerprints=None, small_size=0, throttle=None):
+        if set_headers:
+            if not isinstance(set_headers, types.FunctionType):
+                raise ValueError('argument set_headers must be function')
+        if not root:
+            root = manifest.root if manifest is not None else os.getcwd()
+        self.root = path.abspath(normpath(root))
+        self.root_prefix = self.root if self.root.endswith(path.sep) \
+            else self.root + path.sep
+        self.index = index
+        self.hidden = hidden
+        self.format = format
+        enabled = {'br': brotli, 'zstd': zstd, 'gzip': gzip}
+        self.codings = [coding for coding in ENCODINGS if enabled[coding]]
+        self.set_headers = set_headers
+        self.extensions = normalize_extensions(extensions)
+        self.read_step = as_chunk_size(read_step)
+        self.sendfile = sendfile
+        self.cache = cache
+        self.content_cache = content_cache
+        self.etag = etag
+        self.ranges = ranges
+        self.compress = compress
+        self.manifest = manifest
+        self.pool = pool if pool is not None else DEFAULT_POOL
+        self.fd_cache = fd_cache
+        self.mmap_cache = mmap_cache
+        self.observer = observer
+        self.listing = listing
+        self.flight = flight
+        self.fingerprints = fingerprints
+        self.small_size = small_size
+        self.throttle = throttle
+        self.cache_control = None
+        max_age = int(max_age)
+        if max_age:
+            directives = ['max-age=' + str(max_age), ]
+            if immutable:
+                directives.append('immutable')
+            self.cache_control = ', '.join(directives)
+
 
+def normalize_extensions(extensions):
+    """
+    :param extensions: tried in order for paths without extension,
+        with or without leading dot
+    :type extensions: Union[List[str], None]
+    :return: extensions with leading dot, ``None`` if there is none
+    :rtype: Union[Tuple[str], None]
+    """
+    if not extensions:
+        return None
+    normalized = []
+    for ext in extensions:
+        if not isinstance(ext, str):
+            raise ValueError(
+                'option extensions must be array of strings or false'
+            )
+        normalized.append(ext if ext.startswith('.') else '.' + ext)
+    return tuple(normalized)
+
+
+async def send_with(request, file_path, options, decoded=False):
+    """
+    ``send`` with options built beforehand
+
+    :type request: web.Request
+    :type file_path: str
+    :type options: Options
+    :param decoded: ``file_path`` is already percent-decoded, like
+        ``request.path`` or ``request.match_info`` values
+    :type decoded: bool
+    :rtype: web.StreamResponse
+    """
+    if not file_path:
+        raise ValueError('file_path can\'t be empty string')
+    try:
+        return await _send(request, file_path, options, decoded)
+    except web.HTTPException as e:
+        # 403, 404 and 304, also 503 of a saturated pool
+        if options.observer is not None:
+            options.observer.failed(request, e.status)
+        raise
+
+
+async def _send(request, file_path, options, decoded):
+    pool = options.pool
+    observer = options.observer
+    started = time.perf_counter()
+    res = await _prepare(request, file_path, options, decoded)
     if res:
-        file_path, return_headers, encoding_ext = res
-        read_step = int(read_step)
-        resp = web.StreamResponse(status=200,
+        file_path, return_headers, encoding_ext, stats, ranges, body = res
+        if observer is not None:
+            observer.prepared(request, time.perf_counter() - started)
+        if stats.is_directory:
+            return await options.listing.respond(
+                request, file_path, stats, return_headers,
+                hidden=options.hidden, executor=pool.executor,
+                observer=observer)
+        encoding = return_headers.get('Content-Encoding', 'identity')
+        status = 200 if ranges is None else 206
+        content_type = return_headers.get('Content-Type') \
+            or file_type(file_path, encoding_ext)
+        size = stats.st_size if body is None else len(body)
+        parts = tail = None
+        if ranges is not None and len(ranges) > 1:
+            parts, tail, boundary = multipart_byteranges(
+                ranges, size, content_type)
+            return_headers['Content-Type'] = \
+                'multipart/byteranges; boundary=' + boundary
+            return_headers['Content-Length'] = str(
+                sum(len(head) + end - start for head, start, end in parts)
+                + len(tail))
+
+        content_cache = options.content_cache
+        if body is None and content_cache is not None \
+                and content_cache.accept(stats):
+            body = content_cache.get_body(file_path, stats)
+            if body is None:
+                body = await _load(request, file_path, stats, options)
+                content_cache.set_body(file_path, stats, body)
+        elif body is None and stats.st_size <= options.small_size:
+            # headers and body leave in one write
+            body = await _load(request, file_path, stats, options)
+
+        if body is not None:
+            if parts is not None:
+                body = b''.join(
+                    head + body[start:end] for head, start, end in parts
+                ) + tail
+            elif ranges is not None:
+                start, end = ranges[0]
+                body = body[start:end]
+            return_headers['Content-Length'] = str(len(body))
+            resp = web.Response(status=status, body=body,
+                                headers=return_headers)
+            if content_type and 'Content-Type' not in return_headers:
+                resp.content_type = content_type
+            if observer is not None:
+                observer.sent(request, status, encoding, len(body), 0)
+            return resp
+
+        resp = web.StreamResponse(status=status,
                                   headers=return_headers)
-
-        if not return_headers.get('content-type'):
-            t = file_type(file_path, encoding_ext)
-            if t:
-                resp.content_type = t
-
-        await resp.prepare(request)
-        async with aiofiles.open(file_path, mode='rb', buffering=True) as f:
-            while True:
-                b = await f.read(read_step)
-                if b:
-                    await resp.write(b)
-                else:
-                    break
+        if content_type and 'Content-Type' not in return_headers:
+            resp.content_type = content_type
+
+        mmap_cache = options.mmap_cache
+        fd_cache = options.fd_cache
+        limiter = None
+        if options.throttle is not None:
+            limiter = options.throttle.limiter(
+                request, int(return_headers['Content-Length']))
+        async with pool:
+            mapping = descriptor = None
+            if mmap_cache is not None and mmap_cache.accept(stats):
+                mapping = await mmap_cache.acquire(file_path, stats,
+                                                   executor=pool.executor)
+            if mapping is None and fd_cache is not None \
+                    and fd_cache.accept(stats):
+                descriptor = await fd_cache.acquire(file_path, stats,
+                                                    executor=pool.executor)
+            try:
+                await resp.prepare(request)
+                started = time.perf_counter()
+                await _write_body(
+                    request, resp, file_path, stats, ranges, parts, tail,
+                    read_step=options.read_step, sendfile=options.sendfile,
+                    executor=pool.executor,
+                    file=descriptor.file if descriptor else None,
+                    buffer=mapping.view if mapping else None,
+                    observer=observer,
+                    limiter=limiter)
+            finally:
+                if descriptor is not None:
+                    fd_cache.release(descriptor)
+                if mapping is not None:
+                    mmap_cache.release(mapping)
+        if observer is not None:
+            observer.sent(request, status, encoding,
+                          int(return_headers['Content-Length']),
+                          time.perf_counter() - started)
         return resp
     else:
         raise web.HTTPNotFound()
 
 
-async def _prepare(request,
-                   file_path,
-                   root='',
-                   index=None,
-                   immutable=False,
-                   max_age=0,
-                   hidden=True,
-                   format=True,
-                   brotli=False,
-                   gzip=False,
-                   set_headers=None,
-                   extensions=None,
-                   **kwargs):
+async def _read(file_path, pool):
+    async with pool:
+        async with aiofiles.open(file_path, mode='rb',
+                                 executor=pool.executor) as f:
+            return await f.read()
+
+
+async def _load(request, file_path, stats, options):
     """
-    :type max_age: int
+    read the whole file, sharing the read with concurrent requests
+    when ``options.flight`` is set
+
+    :rtype: bytes
+    """
+    if options.flight is None:
+        body = await _read(file_path, options.pool)
+    else:
+        body = await options.flight.do(
+            ('read', file_path, stats.st_mtime, stats.st_size),
+            _read, file_path, options.pool)
+    if options.observer is not None:
+        options.observer.io(request, 'open')
+        options.observer.io(request, 'read')
+    if len(body) != stats.st_size:
+        # ranges and caches would use the wrong size
+        raise FileChangedError(file_path)
+    return body
+
+
+async def _prepare(request, file_path, options, decoded=False):
+    """
+    resolve the file to send and headers of the response
+
     :type request: web.Request
-    :type file_path:str
-    :type root:str
-    :type index: str
-    :type immutable: bool
-    :type hidden: bool
-    :type format: bool
-    :type brotli: bool
-    :type gzip: bool
-    :type set_headers: Union[typing.Callable, None]
-    :type extensions: List[str]
-    :type read_step: int
+    :type file_path: str
+    :type options: Options
+    :type decoded: bool
+    :return: resolved path, headers, encoding extension, stats,
+        byte ranges and body when it's compressed on the fly,
+        ``None`` when there is no such file
+    :rtype: Union[Tuple[str, CIMultiDict, str, FileState,
+        Union[List[Tuple[int, int]], None], Union[bytes, None]], None]
     """
+    root = options.root
+    manifest = options.manifest
+    cache = options.cache
+    compress = options.compress
+    observer = options.observer
+    flight = options.flight
+    executor = options.pool.executor
+    index = options.index
+    format = options.format
+    extensions = options.extensions
+
+    file_path, trailing_slash = normalize_path(root, options.root_prefix,
+                                               file_path, decoded)
+
+    listing = options.listing
+    if index and trailing_slash:
+        if listing is None:
+            file_path = join(file_path, index)
+        else:
+            # its index, or its listing when there's none
+            format = True
 
-    # options
-    if not file_path:
-        raise ValueError('file_path can\'t be empty string')
-    if set_headers:
-        if not isinstance(set_headers, types.FunctionType):
-            raise ValueError('argument set_headers must be function')
-
-    root = root if root else os.getcwd()
-    root = path.abspath(normpath(root))
-    if '..' in file_path:
-        if check_if_out_of_root(path.splitdrive(file_path)[0], file_path):
-            raise web.HTTPForbidden()
+    if options.hidden and is_hidden(file_path):
+        return
+
+    fingerprints = options.fingerprints
+    fingerprint = None
+    if fingerprints is not None:
+        found = await fingerprints.lookup(file_path)
+        if found is not None:
+            file_path, fingerprint = found
+
+    accept_encoding = request.headers.get('Accept-Encoding', '')
+    encoding_class = negotiate_encoding(accept_encoding, options.codings)
+
+    if manifest is not None:
+        resolved = manifest.resolve(file_path, encoding_class)
+        if resolved is None:
+            return
     else:
-        if check_if_out_of_root('/', file_path):
-            raise web.HTTPForbidden()
+        key = (file_path, encoding_class, format, index, extensions,
+               listing is not None)
+        resolved = None
+        if cache is not None:
+            resolved = await cache.lookup(key, executor=executor)
+        if resolved is None:
+            args = (file_path, index, format, encoding_class, extensions,
+                    listing is not None)
+            if flight is None:
+                resolved = await resolve_path(*args, executor=executor)
+            else:
+                resolved = await flight.do(('resolve', key), resolve_path,
+                                           *args, executor=executor)
+            if observer is not None:
+                observer.io(request, 'resolve')
+            if resolved is None:
+                return
+            if cache is not None:
+                cache.set(key, resolved)
+
+    file_path, stats, encoding_ext = resolved
+    if fingerprint is not None:
+        hashed_path, hashed_stats = file_path, stats
+        if encoding_ext:
+            # a precompressed sibling, the original is what was hashed
+            hashed_path = file_path[:-len(encoding_ext)]
+            r = await asyncio.get_event_loop().run_in_executor(
+                executor, _stat, hashed_path)
+            if observer is not None:
+                observer.io(request, 'resolve')
+            if r is None:
+                return
+            hashed_stats = FileState.from_stat(r)
+        if not fingerprints.check(hashed_path, hashed_stats):
+            # changed since it was hashed, this url is gone
+            return
+    encoding = ENCODING_EXTENSIONS.get(encoding_ext)
+    compress_encoding = None
+    if encoding is None and compress is not None \
+            and not stats.is_directory:
+        compress_encoding = encoding = compress.choose(
+            file_path, stats, encoding_class)
+    if encoding is None and not stats.is_directory \
+            and not identity_acceptable(accept_encoding):
+        raise web.HTTPNotAcceptable()
 
-    if path.isabs(file_path):
-        file_path = remove_driver(file_path)
+    return_headers = CIMultiDict()
+    if encoding:
+        return_headers['Content-Encoding'] = encoding
+        return_headers['Vary'] = 'Accept-Encoding'
+
+    if stats.is_directory and options.listing.output == 'auto':
+        return_headers.add('Vary', 'Accept')
+
+    if options.set_headers:
+        options.set_headers(request, file_path, stats, return_headers)
+
+    etag_value = None
+    if fingerprint is not None:
+        etag_value = '"' + fingerprint + \
+            ('-' + encoding if encoding else '') + '"'
+        return_headers['ETag'] = etag_value
+    elif options.etag:
+        etag_value = stats.etag
+        if compress_encoding:
+            etag_value = etag_value[:-1] + '-' + compress_encoding + '"'
+        elif stats.is_directory:
+            etag_value = etag_value[:-1] + options.listing.variant(
+                request, options.hidden) + '"'
+        return_headers['ETag'] = etag_value
+    return_headers['Content-Length'] = str(stats.st_size)
+    # keep those given by set_headers
+    if 'Last-Modified' not in return_headers:
+        return_headers['Last-Modified'] = stats.last_modified
+    if 'Cache-Control' not in return_headers:
+        if fingerprint is not None:
+            return_headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+        elif options.cache_control:
+            return_headers['Cache-Control'] = options.cache_control
+
+    if is_not_modified(request, stats.st_mtime, etag_value):
+        del return_headers['Content-Length']
+        raise web.HTTPNotModified(headers=return_headers)
+    if stats.is_directory:
+        del return_headers['Content-Length']
+        return file_path, return_headers, encoding_ext, stats, None, None
+
+    body = None
+    size = stats.st_size
+    if compress_encoding:
+        if flight is None:
+            body = await compress.compress(file_path, stats,
+                                           compress_encoding)
+        else:
+            body = await flight.do(
+                ('compress', file_path, compress_encoding, stats.st_mtime,
+                 stats.st_size),
+                compress.compress, file_path, stats, compress_encoding)
+        size = len(body)
+        return_headers['Content-Length'] = str(size)
 
-    file_path = join(root, file_path)
+    byte_ranges = None
+    if options.ranges:
+        return_headers['Accept-Ranges'] = 'bytes'
+        byte_ranges = requested_ranges(request, size, etag_value,
+                                       stats.last_modified)
+        if byte_ranges is not None and len(byte_ranges) == 1:
+            start, end = byte_ranges[0]
+            return_headers['Content-Range'] = 'bytes {}-{}/{}'.format(
+                start, end - 1, size)
+            return_headers['Content-Length'] = str(end - start)
 
-    file_path = normpath(file_path)
+    return file_path, return_headers, encoding_ext, stats, byte_ranges, body
 
-    trailing_slash = file_path.endswith(path.sep)
-    file_path = unquote_plus(file_path)
-    if check_if_out_of_root(root, file_path):
-        raise web.HTTPForbidden()
 
-    if index and trailing_slash:
-        file_path = join(file_path, index)
+ENCODING_EXTENSIONS = {ext: coding for coding, ext in ENCODINGS.items()}
+
+
+def _stat(file_path):
+    try:
+        return os.stat(file_path)
+    except OSError:
+        return None
 
-    if hidden and is_hidden(file_path):
-        return
 
+def _resolve_path(file_path, index, format, encoding_class, extensions,
+                  directories=False):
+    """
+    find the file on disk which should be sent for ``file_path``.
+    Run in one executor job by ``resolve_path``, each candidate path costs
+    one ``stat`` whose result tells existence, type, size and mtime.
+
+    :type file_path: str
+    :type index: str
+    :type format: bool
+    :param encoding_class: acceptable content codings, best first
+    :type encoding_class: Tuple[str]
+    :param extensions: with leading dot, see ``normalize_extensions``
+    :type extensions: Union[Tuple[str], None]
+    :param directories: resolve a directory without index to itself
+    :type directories: bool
+    :return: resolved file path, its stats and encoding extension
+    :rtype: Union[Tuple[str, FileState, str], None]
+    """
     encoding_ext = ''
-    return_headers = CIMultiDict()
-    # serve brotli file when possible otherwise gzipped file when possible
-    accept_encoding = request.headers.get('Accept-Encoding', False)
-
-    if accept_encoding:
-        if brotli and 'br' in accept_encoding \
-                and await file_exist(file_path + '.br'):
-            return_headers['Content-Encoding'] = 'br'
-            file_path = file_path + '.br'
-            encoding_ext = '.br'
-        elif gzip and 'gzip' in accept_encoding \
-                and await file_exist(file_path + '.gz'):
-            return_headers['Content-Encoding'] = 'gzip'
-            file_path = file_path + '.gz'
-            encoding_ext = '.gz'
+    r = None
+    # serve the best precompressed sibling accepted by client
+    for coding in encoding_class:
+        r = _stat(file_path + ENCODINGS[coding])
+        if r is not None:
+            encoding_ext = ENCODINGS[coding]
+            file_path = file_path + encoding_ext
+            break
 
     if extensions and not re.findall(r'\.[^/^\\]*$', file_path):
-        l = list(extensions)
-        for ext in l:
-            if not isinstance(ext, str):
-                raise ValueError(
-                    'option extensions must be array of strings or false'
-                )
-            if not ext.startswith('.'):
-                ext = '.' + ext
-            if await file_exist(file_path + ext):
+        for ext in extensions:
+            r = _stat(file_path + ext)
+            if r is not None:
                 file_path = file_path + ext
                 break
 
-    try:
-        stats = await file_stats(file_path)
-    except OSError:
-        return
+    if r is None:
+        r = _stat(file_path)
+        if r is None:
+            return
 
-    if stats.is_directory:
+    if stat.S_ISDIR(r.st_mode):
         if format and index:
-            file_path += '/' + index
-            stats = await file_stats(file_path)
-        else:
-            raise web.HTTPNotFound()
+            index_path = file_path + '/' + index
+            index_r = _stat(index_path)
+            if index_r is not None:
+                return index_path, FileState.from_stat(index_r), encoding_ext
+        if not directories:
+            return
 
-    if set_headers:
-        set_headers(request, file_path, stats, return_headers)
+    return file_path, FileState.from_stat(r), encoding_ext
 
-    return_headers['Content-Length'] = str(stats.st_size)
-    if not request.headers.get('Last-Modified'):
-        return_headers['Last-Modified'] = to_UTC_string(stats.st_mtime)
-    if not request.headers.get('Cache-Control'):
-        max_age = int(max_age)
-        if max_age:
-            directives = ['max-age=' + str(max_age or 0), ]
-            if immutable:
-                directives.append('immutable')
-            return_headers['Cache-Control'] = ', '.join(directives)
 
-    return file_path, return_headers, encoding_ext
+def is_not_modified(request, st_mtime, etag=None):
+    """
+    check conditional request headers against the file,
+    ``If-None-Match`` takes precedence over ``If-Modified-Since``
+
+    :type request: web.Request
+    :type st_mtime: float
+    :param etag: ETag of the response, ``None`` if it has none
+    :type etag: Union[str, None]
+    :rtype: bool
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match is not None:
+        if etag is None:
+            return False
+        return etag_match(if_none_match, etag)
+    if_modified_since = request.if_modified_since
+    if if_modified_since is None:
+        return False
+    return int(st_mtime) <= if_modified_since.timestamp()
+
+
+# more ranges than this in one request are answered with the whole file
+MAX_RANGES = 16
+
+
+def requested_ranges(request, size, etag, last_modified):
+    """
+    byte ranges of the response requested by ``Range`` header,
+    ``None`` when the whole body should be sent.
+
+    :type request: web.Request
+    :param size: length of the whole body
+    :type size: int
+    :type etag: Union[str, None]
+    :type last_modified: str
+    :return: list of ``(start, end)``, ``end`` excluded
+    :rtype: Union[List[Tuple[int, int]], None]
+    """
+    header = request.headers.get('Range')
+    if not header or request.method not in ('GET', 'HEAD'):
+        return None
+    if_range = request.headers.get('If-Range')
+    if if_range is not None:
+        if if_range.startswith(('"', 'W/')):
+            if if_range != etag:
+                return None
+        elif if_range != last_modified:
+            return None
+    byte_ranges = parse_range(header, size)
+    if byte_ranges is None or len(byte_ranges) > MAX_RANGES:
+        return None
+    if not byte_ranges:
+        raise web.HTTPRequestRangeNotSatisfiable(headers={
+            'Content-Range': 'bytes */{}'.format(size)
+        })
+    return byte_ranges
+
+
+def parse_range(header, size):
+    """
+    parse a ``Range`` header against a file of ``size`` bytes.
+
+    :type header: str
+    :type size: int
+    :return: ``None`` if header is malformed,
+        otherwise satisfiable ranges as ``(start, end)``, ``end`` excluded
+    :rtype: Union[List[Tuple[int, int]], None]
+    """
+    unit, _, specs = header.partition('=')
+    if unit.strip().lower() != 'bytes':
+        return None
+    byte_ranges = []
+    for spec in specs.split(','):
+        first, sep, last = spec.strip().partition('-')
+        if not sep:
+            return None
+        try:
+            if first:
+                start = int(first)
+                end = int(last) + 1 if last else size
+                if start < 0 or last and end <= start:
+                    return None
+            else:
+                suffix = int(last)
+                if suffix < 0:
+                    return None
+                start, end = max(size - suffix, 0), size
+        except ValueError:
+            return None
+        if start < size and end > start:
+            byte_ranges.append((start, min(end, size)))
+    return byte_ranges
+
+
+def multipart_byteranges(byte_ranges, size, content_type):
+    """
+    build the framing of a ``multipart/byteranges`` body
+
+    :type byte_ranges: List[Tuple[int, int]]
+    :type size: int
+    :type content_type: Union[str, None]
+    :return: ``(part header, start, end)`` for each range,
+        closing delimiter and boundary
+    :rtype: Tuple[List[Tuple[bytes, int, int]], bytes, str]
+    """
+    boundary = uuid.uuid4().hex
+    parts = []
+    for i, (start, end) in enumerate(byte_ranges):
+        head = '' if i == 0 else '\r\n'
+        head += '--' + boundary + '\r\n'
+        if content_type:
+            head += 'Content-Type: ' + content_type + '\r\n'
+        head += 'Content-Range: bytes {}-{}/{}\r\n\r\n'.format(
+            start, end - 1, size)
+        parts.append((head.encode('latin-1'), start, end))
+    tail = '\r\n--{}--\r\n'.format(boundary).encode('latin-1')
+    return parts, tail, boundary
+
+
+def etag_match(header, etag):
+    """
+    weak comparison of ``etag`` against a ``If-None-Match`` header value
+
+    :type header: str
+    :type etag: str
+    :rtype: bool
+    """
+    etag = etag[2:] if etag.startswith('W/') else etag
+    for value in header.split(','):
+        value = value.strip()
+        if value == '*':
+            return True
+        if value.startswith('W/'):
+            value = value[2:]
+        if value == etag:
+            return True
+    return False
 
 
 def file_type(file, ext):
+    """
+    content type of ``file``, ignoring its encoding extension ``ext``
+    """
     f = file
-    if ext:
-        f += ext
+    if ext and f.endswith(ext):
+        f = f[:-len(ext)]
     t, _ = mimetypes.guess_type(f)
     return t
 
@@ -213,44 +738,268 @@ def to_UTC_string(a: float):
         '%a, %d %b %Y %H:%M:%S GMT')
 
 
-file_exist = aiofiles.os.wrap(os.path.exists)
-is_directory = aiofiles.os.wrap(os.path.isdir)
+resolve_path = aiofiles.os.wrap(_resolve_path)
+open_file = aiofiles.os.wrap(open)
+if hasattr(os, 'pread'):
+    pread = aiofiles.os.wrap(os.pread)
+else:  # pragma: no cover
+    pread = None
 
+# raised by ``loop.sendfile`` when the transport can't do zero-copy transfer
+SendfileNotAvailableError = getattr(asyncio, 'SendfileNotAvailableError',
+                                    NotImplementedError)
 
-class FileState:
-    st_mtime = 0
-    st_size = 0
-    is_directory = False
 
-    def __init__(self, st_mtime, st_size, is_directory):
-        self.st_mtime = st_mtime
-        self.st_size = st_size
-        self.is_directory = is_directory
+class FileChangedError(OSError):
+    """
+    the file ended before the bytes announced by the response headers
+    were written, it was truncated or replaced meanwhile. Raised after
+    the headers are sent, so aiohttp aborts the connection instead of
+    leaving the client waiting for the missing bytes.
+    """
 
 
-async def file_stats(path):
-    r = await aiofiles.os.stat(path)
-    return FileState(st_mtime=r.st_mtime,
-                     is_directory=await is_directory(path),
-                     st_size=r.st_size)
+async def _write_body(request, resp, file_path, stats, ranges, parts, tail,
+                      **kwargs):
+    """
+    write the whole file, a single range or multipart ranges
+    to a prepared response, ``kwargs`` are passed to ``write_file``.
+    """
+    if parts is not None:
+        for head, start, end in parts:
+            await resp.write(head)
+            await write_file(request, resp, file_path, start, end - start,
+                             **kwargs)
+        await resp.write(tail)
+    elif ranges is not None:
+        start, end = ranges[0]
+        await write_file(request, resp, file_path, start, end - start,
+                         **kwargs)
+    else:
+        await write_file(request, resp, file_path, 0, stats.st_size,
+                         **kwargs)
 
 
-def remove_driver(file_path):
-    if os.path.isabs(file_path):
-        driver, file_path = splitdrive(file_path)
-        file_path = file_path[1:]
-    return file_path
+async def write_file(request, resp, file_path, offset=0, count=None,
+                     read_step=DEFAULT_READ_STEP, sendfile=True,
+                     executor=None, file=None, buffer=None, observer=None,
+                     limiter=None):
+    """
+    write ``count`` bytes of the file from ``offset`` to a prepared response,
+    the whole rest of file when ``count`` is ``None``.
 
+    :type request: web.Request
+    :type resp: web.StreamResponse
+    :type file_path: str
+    :type offset: int
+    :type count: Union[int, None]
+    :type read_step: Union[int, aiohttp_send.ChunkSize]
+    :type sendfile: bool
+    :type executor: Union[concurrent.futures.Executor, None]
+    :param file: already opened and possibly shared binary file of
+        ``file_path``, only read at explicit offsets, never closed here
+    :type file: Union[io.RawIOBase, None]
+    :param buffer: content of file, like a view of its memory mapping,
+        written in slices without reading the file
+    :type buffer: Union[memoryview, None]
+    :param observer: notified of each executor job and zero-copy transfer
+    :type observer: Union[aiohttp_send.Observer, None]
+    :param limiter: waited for before each chunk or ``sendfile`` slice
+    :type limiter: Union[aiohttp_send.throttle.Limiter, None]
+    """
+    if buffer is not None:
+        end = len(buffer) if count is None else offset + count
+        if end > len(buffer):
+            raise FileChangedError(file_path)
+        sizes = as_chunk_size(read_step).sizes(end - offset)
+        while offset < end:
+            step = min(next(sizes), end - offset)
+            if limiter is not None:
+                await limiter.take(step)
+            await resp.write(buffer[offset:offset + step])
+            offset += step
+        return
+    if sendfile and await _sendfile(request, resp, file_path, offset, count,
+                                    executor=executor, file=file,
+                                    observer=observer, limiter=limiter,
+                                    read_step=read_step):
+        return
+    sizes = as_chunk_size(read_step).sizes(count)
+    if file is not None:
+        fd = file.fileno()
+        while count is None or count > 0:
+            step = next(sizes)
+            b = await pread(fd, step if count is None else min(step, count),
+                            offset, executor=executor)
+            if observer is not None:
+                observer.io(request, 'read')
+            if not b:
+                if count is not None:
+                    raise FileChangedError(file_path)
+                break
+            offset += len(b)
+            if count is not None:
+                count -= len(b)
+            if limiter is not None:
+                await limiter.take(len(b))
+            await resp.write(b)
+        return
+    async with aiofiles.open(file_path, mode='rb', executor=executor) as f:
+        if observer is not None:
+            observer.io(request, 'open')
+        if offset:
+            await f.seek(offset)
+        while count is None or count > 0:
+            step = next(sizes)
+            b = await f.read(step if count is None else min(step, count))
+            if observer is not None:
+                observer.io(request, 'read')
+            if not b:
+                if count is not None:
+                    raise FileChangedError(file_path)
+                break
+            if count is not None:
+                count -= len(b)
+            if limiter is not None:
+                await limiter.take(len(b))
+            await resp.write(b)
 
-def in_directory(directory, file):
-    # make both absolute
-    directory = os.path.abspath(directory)
-    file = os.path.abspath(file)
 
-    # return true, if the common prefix of both is equal to directory
-    # e.g. /a/b/c/d.rst and directory is /a/b, the common prefix is /a/b
-    return os.path.commonprefix([file, directory]) == directory
+async def _sendfile(request, resp, file_path, offset=0, count=None,
+                    executor=None, file=None, observer=None, limiter=None,
+                    read_step=DEFAULT_READ_STEP):
+    """
+    hand the file to the kernel with ``loop.sendfile``.
 
+    return ``False`` without writing anything when the transport
+    doesn't support it (TLS, compression, python<3.7),
+    so caller can fall back to chunked reading.
 
-def check_if_out_of_root(root_path: str, file_path: str):
-    return not in_directory(root_path, join(root_path, file_path))
+    :type request: web.Request
+    :type resp: web.StreamResponse
+    :type file_path: str
+    :type offset: int
+    :type count: Union[int, None]
+    :type executor: Union[concurrent.futures.Executor, None]
+    :param file: already opened file, used instead of opening ``file_path``
+    :type file: Union[io.RawIOBase, None]
+    :type observer: Union[aiohttp_send.Observer, None]
+    :param limiter: file is sent in slices of ``read_step``,
+        each one after waiting for it
+    :type limiter: Union[aiohttp_send.throttle.Limiter, None]
+    :type read_step: Union[int, aiohttp_send.ChunkSize]
+    :rtype: bool
+    """
+    loop = asyncio.get_event_loop()
+    transport = request.transport
+    if transport is None or resp.compression \
+            or not hasattr(loop, 'sendfile'):
+        return False
+    f = file
+    if f is None:
+        f = await open_file(file_path, 'rb', executor=executor)
+        if observer is not None:
+            observer.io(request, 'open')
+    try:
+        if limiter is None or count is None:
+            sent = await loop.sendfile(transport, f, offset, count,
+                                       fallback=False)
+            if count is not None and sent < count:
+                raise FileChangedError(file_path)
+        else:
+            sizes = as_chunk_size(read_step).sizes(count)
+            end = offset + count
+            while offset < end:
+                step = min(next(sizes), end - offset)
+                await limiter.take(step)
+                sent = await loop.sendfile(transport, f, offset, step,
+                                           fallback=False)
+                if sent < step:
+                    raise FileChangedError(file_path)
+                offset += step
+    except (SendfileNotAvailableError, NotImplementedError):
+        return False
+    finally:
+        if file is None:
+            f.close()
+    if observer is not None:
+        observer.io(request, 'sendfile')
+    return True
+
+
+class FileState:
+    st_mtime = 0
+    st_size = 0
+    st_ino = 0
+    is_directory = False
+
+    def __init__(self, st_mtime, st_size, is_directory, st_ino=0):
+        self.st_mtime = st_mtime
+        self.st_size = st_size
+        self.is_directory = is_directory
+        self.st_ino = st_ino
+        self._last_modified = None
+
+    @classmethod
+    def from_stat(cls, r):
+        """
+        :type r: os.stat_result
+        :rtype: FileState
+        """
+        return cls(st_mtime=r.st_mtime,
+                   st_size=r.st_size,
+                   is_directory=stat.S_ISDIR(r.st_mode),
+                   st_ino=r.st_ino)
+
+    @property
+    def last_modified(self):
+        """
+        ``st_mtime`` formatted for ``Last-Modified`` header, computed once
+        """
+        if self._last_modified is None:
+            self._last_modified = to_UTC_string(self.st_mtime)
+        return self._last_modified
+
+    @property
+    def etag(self):
+        """
+        strong ETag built from mtime, size and inode
+        """
+        return '"{:x}-{:x}-{:x}"'.format(int(self.st_mtime * 1000),
+                                         self.st_size, self.st_ino)
+
+
+# separators of path segments in requested paths
+_SEPARATORS = re.compile(r'[/\\]' if path.altsep else '/')
+
+
+def normalize_path(root, root_prefix, file_path, decoded=False):
+    """
+    decode ``file_path`` and join it to ``root`` in one pass over its
+    segments. Paths with ``..`` segments, encoded or not, or a null byte
+    are rejected, so the result is always ``root`` or under it.
+
+    :param root: absolute and normalized
+    :type root: str
+    :param root_prefix: ``root`` ending with a separator
+    :type root_prefix: str
+    :type file_path: str
+    :param decoded: ``file_path`` is already decoded, a ``+`` or ``%2B``
+        left in it is part of the name
+    :type decoded: bool
+    :return: absolute path and whether ``file_path`` ended with a separator
+    :rtype: Tuple[str, bool]
+    :raise web.HTTPForbidden: when it would leave ``root``
+    """
+    if not decoded:
+        file_path = unquote_plus(file_path)
+    if '\0' in file_path:
+        raise web.HTTPForbidden()
+    segments = _SEPARATORS.split(splitdrive(file_path)[1])
+    if '..' in segments:
+        raise web.HTTPForbidden()
+    segments = [segment for segment in segments if segment and segment != '.']
+    if not segments:
+        return root, True
+    return (root_prefix + path.sep.join(segments),
+            file_path.endswith(('/', path.sep)))
@@ -0,0 +1,45 @@
+from .send import Options, send_with
+
+
+class StaticFiles:
+    """
+    sends files under ``root`` from its ``handler``.
+
+    Options are the keyword arguments of ``send``, validated and
+    normalized once when the handler is created, so a request only
+    does the work depending on it.
+    """
+
+    def __init__(self, root, **options):
+        """
+        :param root: directory of served files
+        :type root: str
+        """
+        self.options = Options(root=root, **options)
+
+    async def handler(self, request):
+        """
+        aiohttp handler sending the file named by ``filename``
+        of the route, or by path of the request
+
+        :type request: web.Request
+        :rtype: web.StreamResponse
+        """
+        file_path = request.match_info.get('filename', request.path)
+        # aiohttp decoded it already
+        return await send_with(request, file_path or '/', self.options,
+                               decoded=True)
+
+    def add_routes(self, router, prefix='/', name=None):
+        """
+        serve files at ``prefix``, ``GET`` and ``HEAD``
+
+        :type router: web.UrlDispatcher
+        :param prefix: path of ``root`` in urls
+        :type prefix: str
+        :param name: of the route
+        :type name: Union[str, None]
+        :rtype: web.AbstractRoute
+        """
+        return router.add_get(prefix.rstrip('/') + '/{filename:.*}',
+                              self.handler, name=name)
@@ -0,0 +1,139 @@
+import asyncio
+import time
+import weakref
+
+from .cache import LRUCache
+
+
+class TokenBucket:
+    """
+    ``rate`` bytes per second, with bursts up to ``burst`` bytes.
+
+    Senders reserve bytes before writing them and wait for the debt they
+    leave to be paid back, so concurrent senders share the rate in
+    proportion to what they ask for.
+    """
+
+    def __init__(self, rate, burst=None):
+        """
+        :param rate: bytes per second
+        :type rate: float
+        :param burst: bytes sent without waiting after being idle,
+            defaults to ``rate``
+        :type burst: Union[float, None]
+        """
+        if rate <= 0:
+            raise ValueError('rate must be positive')
+        self.rate = rate
+        self.burst = burst if burst is not None else rate
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def reserve(self, size):
+        """
+        :type size: int
+        :return: seconds to wait before sending ``size`` bytes
+        :rtype: float
+        """
+        now = time.monotonic()
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= size
+        return -self.tokens / self.rate if self.tokens < 0 else 0.
+
+
+class Limiter:
+    """
+    buckets a response is sent through
+    """
+
+    def __init__(self, buckets):
+        """
+        :type buckets: List[TokenBucket]
+        """
+        self.buckets = buckets
+
+    async def take(self, size):
+        """
+        wait until ``size`` bytes may be sent through every bucket
+
+        :type size: int
+        """
+        delay = max(bucket.reserve(size) for bucket in self.buckets)
+        if delay:
+            await asyncio.sleep(delay)
+
+
+class Throttle:
+    """
+    token bucket limits on bandwidth of large files sent by ``send``:
+    ``rate`` for all of them, ``per_connection`` for each client
+    connection and ``per_key`` for each value returned by ``key``,
+    like a client address or an API token. Files smaller than
+    ``min_size`` aren't limited and don't count, so small assets
+    keep their latency.
+
+    Bytes are reserved before each chunk or ``sendfile`` slice is
+    written, after the transport drained the previous one.
+    """
+
+    def __init__(self, rate=None, per_connection=None, per_key=None,
+                 key=None, min_size=1024 * 1024, burst=None, maxsize=10000):
+        """
+        :param rate: bytes per second of all responses
+        :type rate: Union[float, None]
+        :param per_connection: bytes per second of each connection
+        :type per_connection: Union[float, None]
+        :param per_key: bytes per second for each key
+        :type per_key: Union[float, None]
+        :param key: key of request, ``None`` for no per key limit
+        :type key: Union[Callable[[web.Request], Hashable], None]
+        :param min_size: smaller responses aren't limited
+        :type min_size: int
+        :param burst: bytes sent without waiting, defaults to one second
+        :type burst: Union[float, None]
+        :param maxsize: keys remembered
+        :type maxsize: int
+        """
+        if per_key is not None and key is None:
+            raise ValueError('per_key needs a key function')
+        self.rate = rate
+        self.per_connection = per_connection
+        self.per_key = per_key
+        self.key = key
+        self.min_size = min_size
+        self.burst = burst
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self._connections = weakref.WeakKeyDictionary()
+        self._keys = LRUCache(maxsize)
+
+    def limiter(self, request, size):
+        """
+        :type request: web.Request
+        :param size: bytes of response body
+        :type size: int
+        :return: limiter of the response, ``None`` when it's not limited
+        :rtype: Union[Limiter, None]
+        """
+        if size < self.min_size:
+            return None
+        buckets = []
+        if self.bucket is not None:
+            buckets.append(self.bucket)
+        transport = request.transport
+        if self.per_connection and transport is not None:
+            bucket = self._connections.get(transport)
+            if bucket is None:
+                bucket = TokenBucket(self.per_connection, self.burst)
+                self._connections[transport] = bucket
+            buckets.append(bucket)
+        if self.per_key:
+            key = self.key(request)
+            if key is not None:
+                bucket = self._keys.get(key)
+                if bucket is None:
+                    bucket = TokenBucket(self.per_key, self.burst)
+                    self._keys.set(key, bucket)
+                buckets.append(bucket)
+        return Limiter(buckets) if buckets else None
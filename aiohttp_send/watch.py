@@ -0,0 +1,291 @@
+import asyncio
+import ctypes
+import ctypes.util
+import os
+import struct
+import sys
+from os import path
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM
+              | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+              | IN_MOVE_SELF)
+
+_EVENT = struct.Struct('iIII')
+
+
+def _libc():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                           use_errno=True)
+        libc.inotify_init1
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+class _Inotify:
+    """
+    recursive watch of roots with linux inotify
+    """
+
+    def __init__(self, watcher, libc):
+        self.watcher = watcher
+        self.libc = libc
+        self.fd = None
+        self.dirs = {}
+        self.tasks = set()
+
+    async def start(self):
+        fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.fd = fd
+        loop = asyncio.get_event_loop()
+        for root in self.watcher.roots:
+            await loop.run_in_executor(None, self._add_tree, root)
+        loop.add_reader(fd, self._read)
+
+    async def stop(self):
+        for task in list(self.tasks):
+            task.cancel()
+        if self.fd is not None:
+            asyncio.get_event_loop().remove_reader(self.fd)
+            os.close(self.fd)
+            self.fd = None
+            self.dirs.clear()
+
+    def _add_tree(self, root):
+        """
+        blocking, watch ``root`` and directories under it.
+        Each directory is watched before it's listed, so a file created
+        meanwhile is either listed or reported by inotify.
+
+        :return: paths of entries found under ``root``
+        :rtype: List[str]
+        """
+        found = []
+        stack = [root]
+        while stack:
+            dir_path = stack.pop()
+            fd = self.fd
+            if fd is None:
+                break
+            wd = self.libc.inotify_add_watch(
+                fd, os.fsencode(dir_path), WATCH_MASK)
+            if wd >= 0:
+                self.dirs[wd] = dir_path
+            try:
+                with os.scandir(dir_path) as it:
+                    for entry in it:
+                        found.append(entry.path)
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+            except OSError:
+                continue
+        return found
+
+    def _watch_new(self, dir_path):
+        task = asyncio.ensure_future(self._add_new_tree(dir_path))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _add_new_tree(self, dir_path):
+        loop = asyncio.get_event_loop()
+        found = await loop.run_in_executor(None, self._add_tree, dir_path)
+        if found and self.fd is not None:
+            # created before their directory was watched
+            self.watcher.notify(found)
+
+    def _read(self):
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        changed = []
+        offset = 0
+        while offset + _EVENT.size <= len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                self.watcher.notify_all()
+                continue
+            if mask & IN_IGNORED:
+                self.dirs.pop(wd, None)
+                continue
+            dir_path = self.dirs.get(wd)
+            if dir_path is None:
+                continue
+            p = path.join(dir_path, os.fsdecode(name)) if name else dir_path
+            changed.append(p)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self._watch_new(p)
+                if mask & IN_MOVED_FROM:
+                    # files of a moved away tree don't get their own events
+                    self.watcher.notify_all()
+        if changed:
+            self.watcher.notify(changed)
+
+
+class _Polling:
+    """
+    compare mtime and size of every file under roots each ``interval``
+    """
+
+    def __init__(self, watcher, interval):
+        self.watcher = watcher
+        self.interval = interval
+        self.task = None
+        self.snapshot = None
+
+    def _scan(self):
+        snapshot = {}
+        for root in self.watcher.roots:
+            for dir_path, _, file_names in os.walk(root):
+                for name in file_names:
+                    p = path.join(dir_path, name)
+                    try:
+                        r = os.stat(p)
+                    except OSError:
+                        continue
+                    snapshot[p] = (r.st_mtime, r.st_size, r.st_ino)
+        return snapshot
+
+    async def start(self):
+        loop = asyncio.get_event_loop()
+        self.snapshot = await loop.run_in_executor(None, self._scan)
+        self.task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def _run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            await asyncio.sleep(self.interval)
+            snapshot = await loop.run_in_executor(None, self._scan)
+            old = self.snapshot
+            changed = [p for p, v in snapshot.items() if old.get(p) != v]
+            changed.extend(p for p in old if p not in snapshot)
+            self.snapshot = snapshot
+            if changed:
+                self.watcher.notify(changed)
+
+
+class Watcher:
+    """
+    watch ``roots`` and invalidate ``caches`` when files change.
+
+    changes are collected for ``delay`` seconds and pushed in one batch,
+    a batch larger than ``max_batch`` paths clears caches instead,
+    so a big deploy doesn't cause an invalidation storm.
+    Uses inotify on linux and polls every ``interval`` seconds elsewhere.
+    """
+
+    def __init__(self, roots, caches, delay=0.2, max_batch=1000,
+                 interval=1.0, inotify=None):
+        """
+        :type roots: List[str]
+        :param caches: objects with ``invalidate(paths)`` and ``clear()``,
+            like ``PathCache``, ``ContentCache`` or ``Compressor``
+        :type caches: List
+        :type delay: float
+        :type max_batch: int
+        :param interval: seconds between scans when polling
+        :type interval: float
+        :param inotify: force or disable inotify, ``None`` to detect
+        :type inotify: Union[bool, None]
+        """
+        self.roots = [path.abspath(path.normpath(r)) for r in roots]
+        self.caches = list(caches)
+        self.delay = delay
+        self.max_batch = max_batch
+        self.batches = 0
+        self.invalidations = 0
+        self._pending = set()
+        self._overflow = False
+        self._handle = None
+        libc = _libc() if inotify is not False else None
+        if inotify and libc is None:
+            raise RuntimeError('inotify is not available')
+        if libc is not None:
+            self._backend = _Inotify(self, libc)
+        else:
+            self._backend = _Polling(self, interval)
+
+    @property
+    def uses_inotify(self):
+        return isinstance(self._backend, _Inotify)
+
+    async def start(self):
+        await self._backend.start()
+
+    async def stop(self):
+        await self._backend.stop()
+        if self._handle is not None:
+            self._handle.cancel()
+            self._flush()
+
+    def notify(self, paths):
+        """
+        record changed paths, they are pushed to caches after ``delay``
+
+        :type paths: Iterable[str]
+        """
+        if not self._overflow:
+            self._pending.update(paths)
+            if len(self._pending) > self.max_batch:
+                self.notify_all()
+                return
+        self._schedule()
+
+    def notify_all(self):
+        """
+        anything may have changed, caches will be cleared
+        """
+        self._overflow = True
+        self._pending.clear()
+        self._schedule()
+
+    def _schedule(self):
+        if self._handle is None:
+            self._handle = asyncio.get_event_loop().call_later(
+                self.delay, self._flush)
+
+    def _flush(self):
+        self._handle = None
+        if not self._overflow and not self._pending:
+            return
+        self.batches += 1
+        if self._overflow:
+            for cache in self.caches:
+                cache.clear()
+        else:
+            self.invalidations += len(self._pending)
+            for cache in self.caches:
+                cache.invalidate(self._pending)
+        self._pending = set()
+        self._overflow = False
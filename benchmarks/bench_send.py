@@ -0,0 +1,277 @@
+"""
+benchmark ``send`` against aiohttp's ``FileResponse`` and ``add_static``.
+
+The server runs in a child process, the load generator in this one.
+Every combination of scenario, file size and concurrency is measured,
+results are printed as a table and optionally written as json.
+
+    python benchmarks/bench_send.py --sizes 1K 64K 1M --concurrency 1 32
+    python benchmarks/bench_send.py --output new.json --compare old.json
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import multiprocessing
+import os
+import socket
+import sys
+import tempfile
+import time
+from os import path
+
+import aiohttp
+from aiohttp import web
+
+sys.path.insert(0, path.join(path.dirname(__file__), '..'))
+from aiohttp_send import send
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+# name -> (send options, request path, request headers)
+SCENARIOS = {
+    'send': ({}, '/send/{name}', {}),
+    'send-chunked': ({'sendfile': False}, '/send/{name}', {}),
+    'send-small': ({'small_size': 16 * 1024}, '/send/{name}', {}),
+    'send-gzip': ({'gzip': True}, '/send/{name}',
+                  {'Accept-Encoding': 'gzip'}),
+    'send-brotli': ({'brotli': True}, '/send/{name}',
+                    {'Accept-Encoding': 'br'}),
+    'send-extensions': ({'extensions': ['txt', 'bin']}, '/send/{stem}', {}),
+    'send-index': ({'index': 'index.bin'}, '/send/{stem}/', {}),
+    'send-hidden': ({'hidden': False}, '/send/{name}', {}),
+    'file-response': (None, '/file_response/{name}', {}),
+    'add-static': (None, '/static/{name}', {}),
+}
+
+
+def parse_size(value):
+    value = value.upper()
+    if value[-1] in UNITS:
+        return int(value[:-1]) * UNITS[value[-1]]
+    return int(value)
+
+
+# brotli quality 11 takes minutes on files of hundreds of megabytes,
+# larger fixtures are compressed at moderate levels
+MAX_QUALITY_SIZE = 16 * 1024 ** 2
+LARGE_QUALITY = 5
+
+
+def make_fixtures(root, sizes, compress, quality=None):
+    """
+    ``blob-<size>.bin``, its ``.gz``/``.br`` siblings
+    and ``blob-<size>/index.bin`` for each size
+
+    :param quality: of brotli siblings, defaults to 11 up to
+        ``MAX_QUALITY_SIZE`` and ``LARGE_QUALITY`` above
+    """
+    for size in sizes:
+        stem = 'blob-{}'.format(size)
+        data = os.urandom(size // 2) + b'a' * (size - size // 2)
+        with open(path.join(root, stem + '.bin'), 'wb') as f:
+            f.write(data)
+        os.mkdir(path.join(root, stem))
+        with open(path.join(root, stem, 'index.bin'), 'wb') as f:
+            f.write(data)
+        if compress:
+            with open(path.join(root, stem + '.bin.gz'), 'wb') as f:
+                f.write(gzip.compress(data, compresslevel=(
+                    9 if size <= MAX_QUALITY_SIZE else 6)))
+            if brotli is not None:
+                with open(path.join(root, stem + '.bin.br'), 'wb') as f:
+                    f.write(brotli.compress(data, quality=(
+                        quality if quality is not None
+                        else 11 if size <= MAX_QUALITY_SIZE
+                        else LARGE_QUALITY)))
+
+
+def serve(root, port, options):
+    options = dict({'brotli': False, 'gzip': False}, **options)
+
+    async def handle_send(request):
+        return await send(request, request.match_info['tail'], root=root,
+                          **options)
+
+    async def handle_file_response(request):
+        return web.FileResponse(path.join(root, request.match_info['tail']))
+
+    app = web.Application()
+    app.router.add_get('/send/{tail:.*}', handle_send)
+    app.router.add_get('/file_response/{tail:.*}', handle_file_response)
+    app.router.add_static('/static/', root)
+    web.run_app(app, host='127.0.0.1', port=port, print=None,
+                access_log=None)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+async def wait_server(url):
+    async with aiohttp.ClientSession() as session:
+        for _ in range(100):
+            try:
+                async with session.get(url):
+                    return
+            except aiohttp.ClientConnectionError:
+                await asyncio.sleep(0.1)
+    raise RuntimeError('server did not start')
+
+
+async def load(url, headers, concurrency, requests):
+    """
+    :return: latency of each request in seconds, total bytes and duration
+    """
+    # aiohttp client asks for gzip by default, FileResponse would honour it
+    headers = dict({'Accept-Encoding': 'identity'}, **headers)
+    latencies = []
+    received = 0
+    remaining = requests
+    connector = aiohttp.TCPConnector(limit=concurrency)
+
+    async def worker(session):
+        nonlocal received, remaining
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            async with session.get(url, headers=headers) as resp:
+                assert resp.status == 200, resp.status
+                async for chunk in resp.content.iter_any():
+                    received += len(chunk)
+            latencies.append(time.perf_counter() - start)
+
+    async with aiohttp.ClientSession(connector=connector,
+                                     auto_decompress=False) as session:
+        start = time.perf_counter()
+        await asyncio.gather(*[worker(session) for _ in range(concurrency)])
+        duration = time.perf_counter() - start
+    return latencies, received, duration
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(int(len(values) * p / 100), len(values) - 1)]
+
+
+def requests_for(size, concurrency, budget):
+    """
+    enough requests to move about ``budget`` bytes, within sane bounds
+    """
+    return max(min(budget // max(size, 1), 5000), concurrency * 4, 20)
+
+
+async def run(args):
+    sizes = [parse_size(s) for s in args.sizes]
+    results = []
+    with tempfile.TemporaryDirectory() as root:
+        make_fixtures(root, sizes, compress=True, quality=args.quality)
+        processes = {}
+        ports = {}
+        for scenario in args.scenarios:
+            options = SCENARIOS[scenario][0]
+            key = json.dumps(options or {}, sort_keys=True)
+            if key not in ports:
+                ports[key] = free_port()
+                processes[key] = multiprocessing.Process(
+                    target=serve, args=(root, ports[key], options or {}),
+                    daemon=True)
+                processes[key].start()
+                await wait_server(
+                    'http://127.0.0.1:{}/static/'.format(ports[key]))
+        try:
+            for scenario in args.scenarios:
+                options, url_path, headers = SCENARIOS[scenario]
+                port = ports[json.dumps(options or {}, sort_keys=True)]
+                for size in sizes:
+                    stem = 'blob-{}'.format(size)
+                    url = 'http://127.0.0.1:{}{}'.format(
+                        port, url_path.format(name=stem + '.bin', stem=stem))
+                    for concurrency in args.concurrency:
+                        n = requests_for(size, concurrency, args.budget)
+                        await load(url, headers, concurrency,
+                                   min(n, concurrency * 2))  # warm up
+                        latencies, received, duration = await load(
+                            url, headers, concurrency, n)
+                        result = {
+                            'scenario': scenario,
+                            'size': size,
+                            'concurrency': concurrency,
+                            'requests': n,
+                            'rps': n / duration,
+                            'p50_ms': percentile(latencies, 50) * 1000,
+                            'p99_ms': percentile(latencies, 99) * 1000,
+                            'mb_s': received / duration / 1024 / 1024,
+                        }
+                        results.append(result)
+                        print('{scenario:<16} {size:>11} c={concurrency:<4} '
+                              '{rps:>9.1f} req/s  p50 {p50_ms:>8.2f} ms  '
+                              'p99 {p99_ms:>8.2f} ms  {mb_s:>9.1f} MB/s'
+                              .format(**result))
+        finally:
+            for p in processes.values():
+                p.terminate()
+                p.join()
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    :return: descriptions of results slower than baseline by ``tolerance``
+    """
+    key = lambda r: (r['scenario'], r['size'], r['concurrency'])
+    old = {key(r): r for r in baseline}
+    regressions = []
+    for r in results:
+        b = old.get(key(r))
+        if b and r['rps'] < b['rps'] * (1 - tolerance):
+            regressions.append(
+                '{} size={} c={}: {:.1f} -> {:.1f} req/s'.format(
+                    r['scenario'], r['size'], r['concurrency'],
+                    b['rps'], r['rps']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--sizes', nargs='+', default=['1K', '64K', '1M'],
+                        help='file sizes, like 1K 1M 1G')
+    parser.add_argument('--concurrency', nargs='+', type=int,
+                        default=[1, 16])
+    parser.add_argument('--scenarios', nargs='+', default=list(SCENARIOS),
+                        choices=list(SCENARIOS))
+    parser.add_argument('--budget', type=parse_size, default='64M',
+                        help='bytes to transfer per measurement')
+    parser.add_argument('--quality', type=int, default=None,
+                        help='brotli quality of fixtures, defaults to 11 '
+                             'up to 16M and 5 above')
+    parser.add_argument('--output', help='write results as json')
+    parser.add_argument('--compare', help='json results of a previous run')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='allowed req/s drop against --compare')
+    args = parser.parse_args()
+
+    loop = asyncio.new_event_loop()
+    results = loop.run_until_complete(run(args))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print('regression:', line)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
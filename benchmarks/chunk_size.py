@@ -0,0 +1,67 @@
+"""
+compare throughput of ``read_step`` strategies on the chunked path.
+
+    python benchmarks/chunk_size.py --size 256 --repeat 5
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from os import path
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+sys.path.insert(0, path.join(path.dirname(__file__), '..'))
+from aiohttp_send import (AdaptiveChunkSize, FileSizeChunkSize,
+                          FixedChunkSize, send)
+
+STRATEGIES = [
+    FixedChunkSize(1024 * 4),
+    FixedChunkSize(1024 * 64),
+    FixedChunkSize(1024 * 1024),
+    FileSizeChunkSize(),
+    AdaptiveChunkSize(),
+    AdaptiveChunkSize(maximum=1024 * 1024),
+]
+
+
+async def measure(root, name, strategy, repeat):
+    async def handler(request):
+        return await send(request, name, root=root, sendfile=False,
+                          read_step=strategy)
+
+    app = web.Application()
+    app.router.add_get('/', handler)
+    best = None
+    async with TestClient(TestServer(app)) as client:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            resp = await client.get('/')
+            size = 0
+            async for chunk in resp.content.iter_any():
+                size += len(chunk)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+    return size / best / 1024 / 1024
+
+
+async def main(args):
+    with tempfile.TemporaryDirectory() as root:
+        name = 'blob.bin'
+        with open(path.join(root, name), 'wb') as f:
+            for _ in range(args.size):
+                f.write(os.urandom(1024 * 1024))
+        for strategy in STRATEGIES:
+            mb_s = await measure(root, name, strategy, args.repeat)
+            print('{:<70} {:>10.1f} MB/s'.format(repr(strategy), mb_s))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size', type=int, default=64, help='file size, MiB')
+    parser.add_argument('--repeat', type=int, default=3)
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(main(parser.parse_args()))
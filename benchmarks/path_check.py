@@ -0,0 +1,68 @@
+"""
+per-request cost of joining requested paths to root and checking
+they stay in it, before and after ``normalize_path``.
+
+    python benchmarks/path_check.py --number 100000
+"""
+import argparse
+import os
+import sys
+import timeit
+from os import path
+from os.path import join, normpath, splitdrive
+from urllib.parse import unquote_plus
+
+sys.path.insert(0, path.join(path.dirname(__file__), '..'))
+from aiohttp_send.send import normalize_path
+
+PATHS = [
+    'index.html',
+    '/static/js/app.3f2a1c.js',
+    'a/b/c/d/e/f/g/h/file.txt',
+    '/docs/guide/getting%20started.html',
+]
+
+
+def legacy(root, file_path):
+    # the checks ``_prepare`` made before ``normalize_path``
+    def in_directory(directory, file):
+        directory = os.path.abspath(directory)
+        file = os.path.abspath(file)
+        return os.path.commonprefix([file, directory]) == directory
+
+    def check_if_out_of_root(root_path, file_path):
+        return not in_directory(root_path, join(root_path, file_path))
+
+    if '..' in file_path:
+        if check_if_out_of_root(splitdrive(file_path)[0], file_path):
+            return
+    elif check_if_out_of_root('/', file_path):
+        return
+    if path.isabs(file_path):
+        file_path = splitdrive(file_path)[1][1:]
+    file_path = normpath(join(root, file_path))
+    file_path = unquote_plus(file_path)
+    if check_if_out_of_root(root, file_path):
+        return
+    return file_path
+
+
+def main(args):
+    root = path.abspath(args.root)
+    prefix = root.rstrip(path.sep) + path.sep
+    for name, func in (('legacy', lambda p: legacy(root, p)),
+                       ('normalize_path',
+                        lambda p: normalize_path(root, prefix, p))):
+        for file_path in PATHS:
+            best = min(timeit.repeat(lambda: func(file_path),
+                                     number=args.number, repeat=3))
+            print('{:<16} {:<40} {:>8.2f} us'.format(
+                name, file_path, best / args.number * 1e6))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--root', default='/srv/public')
+    parser.add_argument('--number', type=int, default=100000,
+                        help='calls per measurement')
+    main(parser.parse_args())
@@ -1,4 +1,6 @@
+import asyncio
 import aiohttp.test_utils
+import pytest
 from aiohttp import web
 from aiohttp.test_utils import AioHTTPTestCase, unittest_run_loop
 import os
@@ -311,6 +313,30 @@ async def test_max_age_immutable(aiohttp_client):
     assert resp.headers['Cache-Control'] == 'max-age=5, immutable'
 
 
+async def test_max_age_client_cache_control(aiohttp_client):
+    app = web.Application()
+    app.router.add_get('/', wrapper('/tests/fixtures/gzip.json', max_age=5))
+    client = await aiohttp_client(app)
+    resp = await client.get('/', headers={'Cache-Control': 'no-cache'})
+    assert resp.status == 200
+    assert resp.headers['Cache-Control'] == 'max-age=5'
+
+
+async def test_set_headers_kept(aiohttp_client):
+    def set_headers(request, file_path, stats, headers):
+        headers['Cache-Control'] = 'no-store'
+        headers['Last-Modified'] = 'Thu, 01 Jan 1970 00:00:00 GMT'
+
+    app = web.Application()
+    app.router.add_get('/', wrapper('/tests/fixtures/gzip.json', max_age=5,
+                                    set_headers=set_headers))
+    client = await aiohttp_client(app)
+    resp = await client.get('/')
+    assert resp.status == 200
+    assert resp.headers['Cache-Control'] == 'no-store'
+    assert resp.headers['Last-Modified'] == 'Thu, 01 Jan 1970 00:00:00 GMT'
+
+
 async def test_only_immutable_no_cache_control(aiohttp_client):
     app = web.Application()
     app.router.add_get('/', wrapper('/tests/fixtures/gzip.json',
@@ -421,3 +447,1489 @@ async def test_extensions_return_first(aiohttp_client):
     assert resp.headers['content-type'] == 'application/json'
 
 # todo set_headers
+
+
+async def test_sendfile_disabled(aiohttp_client):
+    app = web.Application()
+    app.router.add_get('/', wrapper('/tests/fixtures/user.json',
+                                    sendfile=False))
+    client = await aiohttp_client(app)
+    resp = await client.get('/')
+    assert resp.status == 200
+    assert '{ "name": "tobi" }' == await resp.text()
+
+
+async def test_sendfile_not_available_fallback(aiohttp_client, monkeypatch):
+    import asyncio
+    from aiohttp_send.send import SendfileNotAvailableError
+
+    async def not_available(*args, **kwargs):
+        raise SendfileNotAvailableError()
+
+    monkeypatch.setattr(asyncio.get_event_loop(), 'sendfile', not_available,
+                        raising=False)
+    app = web.Application()
+    app.router.add_get('/', wrapper('/tests/fixtures/user.json'))
+    client = await aiohttp_client(app)
+    resp = await client.get('/')
+    assert resp.status == 200
+    assert '{ "name": "tobi" }' == await resp.text()
+
+
+async def test_path_cache_hit(aiohttp_client):
+    from aiohttp_send import PathCache
+    cache = PathCache(maxsize=2)
+    app = web.Application()
+    app.router.add_get('/', wrapper('/tests/fixtures/gzip.json', cache=cache))
+    client = await aiohttp_client(app)
+    for _ in range(3):
+        resp = await client.get('/', headers={'Accept-Encoding': 'gzip'})
+        assert resp.status == 200
+        assert resp.headers['Content-Length'] == '48'
+    resp = await client.get('/', headers={'Accept-Encoding': 'identity'})
+    assert resp.headers['Content-Length'] == '18'
+    assert cache.hits == 2
+    assert cache.misses == 2
+    assert len(cache) == 2
+
+
+@pytest.mark.parametrize('sendfile', [True, False])
+async def test_path_cache_file_changed(aiohttp_client, tmp_path, sendfile):
+    from aiohttp_send import PathCache
+    cache = PathCache()
+    (tmp_path / 'a.txt').write_text('hello')
+    app = web.Application()
+    app.router.add_get('/', wrapper('a.txt', root=str(tmp_path), cache=cache,
+                                    sendfile=sendfile))
+    client = await aiohttp_client(app)
+    resp = await client.get('/')
+    assert await resp.text() == 'hello'
+    for content in ('hello world', 'hi'):
+        (tmp_path / 'a.txt').write_text(content)
+        resp = await client.get('/')
+        assert resp.headers['Content-Length'] == str(len(content))
+        assert await resp.text() == content
+    assert cache.misses == 3
+    resp = await client.get('/')
+    assert cache.hits == 1
+    (tmp_path / 'a.txt').unlink()
+    resp = await client.get('/')
+    assert resp.status == 404
+
+
+@pytest.mark.parametrize('sendfile', [True, False])
+async def test_file_shrunk_while_sending(aiohttp_client, tmp_path, sendfile):
+    import aiohttp
+    from aiohttp_send.send import FileChangedError, write_file
+    (tmp_path / 'a.bin').write_bytes(b'x' * 10)
+    errors = []
+
+    async def handler(request):
+        # headers announce the size the file had when it was resolved
+        resp = web.StreamResponse(headers={'Content-Length': '100'})
+        await resp.prepare(request)
+        try:
+            await write_file(request, resp, str(tmp_path / 'a.bin'), 0, 100,
+                             sendfile=sendfile)
+        except FileChangedError as e:
+            errors.append(e)
+            raise
+        return resp
+
+    app = web.Application()
+    app.router.add_get('/', handler)
+    client = await aiohttp_client(app)
+    resp = await client.get('/')
+    with pytest.raises(aiohttp.ClientPayloadError):
+        await asyncio.wait_for(resp.read(), 5)
+    assert len(errors) == 1
+
+
+def test_lru_cache_ttl_and_eviction(monkeypatch):
+    import time
+    from aiohttp_send import LRUCache
+    now = [100.0]
+    monkeypatch.setattr(time, 'monotonic', lambda: now[0])
+    cache = LRUCache(maxsize=2, ttl=10)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert 'b' not in cache
+    now[0] += 11
+    assert cache.get('a') is None
+    assert cache.stats() == {'size': 1, 'currsize': 1, 'maxsize': 2,
+                             'hits': 1, 'misses': 1}
+
+
+async def test_content_cache(aiohttp_client, tmp_path):
+    from aiohttp_send import ContentCache
+    cache = ContentCache(maxsize=1024, max_entry_size=8)
+    (tmp_path / 'small.txt').write_text('small')
+    (tmp_path / 'large.txt').write_text('large file')
+
+    async def handler(r):
+        return await send(r, r.match_info['name'], root=str(tmp_path),
+                          content_cache=cache)
+
+    app = web.Application()
+    app.router.add_get('/{name}', handler)
+    client = await aiohttp_client(app)
+    for _ in range(2):
+        resp = await client.get('/small.txt')
+        assert resp.status == 200
+        assert resp.headers['content-type'] == 'text/plain'
+        assert await resp.text() == 'small'
+    resp = await client.get('/large.txt')
+    assert await resp.text() == 'large file'
+    assert cache.hits == 1
+    assert cache.misses == 1
+    assert cache.currsize == 5
+
+    (tmp_path / 'small.txt').write_text('smaller')
+    resp = await client.get('/small.txt')
+    assert await resp.text() == 'smaller'
+    assert cache.misses == 2
+
+
+def test_content_cache_byte_budget():
+    from aiohttp_send import ContentCache
+    from aiohttp_send.send import FileState
+    cache = ContentCache(maxsize=10, max_entry_size=8)
+    for name in 'abc':
+        cache.set_body(name, FileState(1, 4, False), b'1234')
+    assert 'a' not in cache
+    assert cache.currsize == 8
+    assert cache.get_body('c', FileState(1, 4, False)) == b'1234'
+    assert cache.get_body('c', FileState(2, 4, False)) is None
+    assert cache.currsize == 4
+
+
+async def test_etag(aiohttp_client):
+    app = web.Application()
+    app.router.add_get('/', wrapper('/tests/fixtures/user.json'))
+    client = await aiohttp_client(app)
+    resp = await client.get('/')
+    assert resp.status == 200
+    etag = resp.headers['ETag']
+    assert etag.startswith('"')
+
+    resp = await client.get('/', headers={'If-None-Match': etag})
+    assert resp.status == 304
+    assert resp.headers['ETag'] == etag
+    assert await resp.read() == b''
+
+    resp = await client.get('/', headers={'If-None-Match': '"a", W/' + etag})
+    assert resp.status == 304
+
+    resp = await client.get('/', headers={'If-None-Match': '"other"'})
+    assert resp.status == 200
+
+
+async def test_etag_disabled(aiohttp_client):
+    app = web.Application()
+    app.router.add_get('/', wrapper('/tests/fixtures/user.json', etag=False))
+    client = await aiohttp_client(app)
+    resp = await client.get('/', headers={'If-None-Match': '*'})
+    assert resp.status == 200
+    assert 'ETag' not in resp.headers
+
+
+async def test_if_modified_since(aiohttp_client):
+    app = web.Application()
+    app.router.add_get('/', wrapper('/tests/fixtures/user.json'))
+    client = await aiohttp_client(app)
+    resp = await client.get('/')
+    last_modified = resp.headers['Last-Modified']
+
+    resp = await client.get('/', headers={'If-Modified-Since': last_modified})
+    assert resp.status == 304
+
+    resp = await client.get('/', headers={
+        'If-Modified-Since': 'Thu, 01 Jan 1970 00:00:00 GMT'})
+    assert resp.status == 200
+
+    # If-None-Match takes precedence
+    resp = await client.get('/', headers={'If-Modified-Since': last_modified,
+                                          'If-None-Match': '"other"'})
+    assert resp.status == 200
+
+
+async def test_range(aiohttp_client):
+    app = web.Application()
+    app.router.add_get('/', wrapper('/tests/fixtures/user.json'))
+    client = await aiohttp_client(app)
+    resp = await client.get('/')
+    assert resp.headers['Accept-Ranges'] == 'bytes'
+
+    resp = await client.get('/', headers={'Range': 'bytes=2-7'})
+    assert resp.status == 206
+    assert resp.headers['Content-Range'] == 'bytes 2-7/18'
+    assert resp.headers['Content-Length'] == '6'
+    assert await resp.read() == b'"name"'
+
+    resp = await client.get('/', headers={'Range': 'bytes=-3'})
+    assert resp.status == 206
+    assert await resp.read() == b'" }'
+
+    resp = await client.get('/', headers={'Range': 'bytes=10-'})
+    assert resp.status == 206
+    assert await resp.read() == b'"tobi" }'
+
+
+async def test_range_sendfile_disabled(aiohttp_client):
+    app = web.Application()
+    app.router.add_get('/', wrapper('/tests/fixtures/user.json',
+                                    sendfile=False, read_step=4))
+    client = await aiohttp_client(app)
+    resp = await client.get('/', headers={'Range': 'bytes=2-7'})
+    assert resp.status == 206
+    assert await resp.read() == b'"name"'
+
+
+async def test_range_not_satisfiable(aiohttp_client):
+    app = web.Application()
+    app.router.add_get('/', wrapper('/tests/fixtures/user.json'))
+    client = await aiohttp_client(app)
+    resp = await client.get('/', headers={'Range': 'bytes=100-'})
+    assert resp.status == 416
+    assert resp.headers['Content-Range'] == 'bytes */18'
+
+    # malformed header is ignored
+    resp = await client.get('/', headers={'Range': 'bytes=a-b'})
+    assert resp.status == 200
+    assert resp.headers['Content-Length'] == '18'
+
+
+async def test_if_range(aiohttp_client):
+    app = web.Application()
+    app.router.add_get('/', wrapper('/tests/fixtures/user.json'))
+    client = await aiohttp_client(app)
+    resp = await client.get('/')
+    etag = resp.headers['ETag']
+    last_modified = resp.headers['Last-Modified']
+
+    for if_range in (etag, last_modified):
+        resp = await client.get('/', headers={'Range': 'bytes=2-7',
+                                              'If-Range': if_range})
+        assert resp.status == 206
+
+    resp = await client.get('/', headers={'Range': 'bytes=2-7',
+                                          'If-Range': '"other"'})
+    assert resp.status == 200
+    assert await resp.read() == b'{ "name": "tobi" }'
+
+
+async def test_multiple_ranges(aiohttp_client):
+    from aiohttp_send import ContentCache
+    for kwargs in ({}, {'content_cache': ContentCache()}):
+        app = web.Application()
+        app.router.add_get('/', wrapper('/tests/fixtures/user.json', **kwargs))
+        client = await aiohttp_client(app)
+        resp = await client.get('/', headers={'Range': 'bytes=2-7,-3'})
+        assert resp.status == 206
+        assert resp.content_type == 'multipart/byteranges'
+        body = await resp.read()
+        assert len(body) == int(resp.headers['Content-Length'])
+        boundary = resp.headers['Content-Type'].split('boundary=')[1]
+        chunks = body.split(b'--' + boundary.encode())
+        assert b'Content-Range: bytes 2-7/18\r\n\r\n"name"\r\n' in chunks[1]
+        assert b'Content-Type: application/json' in chunks[1]
+        assert b'Content-Range: bytes 15-17/18\r\n\r\n" }\r\n' in chunks[2]
+        assert chunks[3] == b'--\r\n'
+        await client.close()
+
+
+def test_parse_range():
+    from aiohttp_send.send import parse_range
+    assert parse_range('bytes=0-0', 10) == [(0, 1)]
+    assert parse_range('bytes=5-100', 10) == [(5, 10)]
+    assert parse_range('bytes=-100', 10) == [(0, 10)]
+    assert parse_range('bytes=0-1, 4-', 10) == [(0, 2), (4, 10)]
+    assert parse_range('bytes=10-', 10) == []
+    assert parse_range('bytes=3-1', 10) is None
+    assert parse_range('items=0-1', 10) is None
+    assert parse_range('bytes=1', 10) is None
+
+
+async def test_read_step_strategy(aiohttp_client, tmp_path):
+    from aiohttp_send import AdaptiveChunkSize
+    content = os.urandom(100 * 1024)
+    (tmp_path / 'blob.bin').write_bytes(content)
+    app = web.Application()
+    app.router.add_get('/', wrapper('blob.bin', root=str(tmp_path),
+                                    sendfile=False,
+                                    read_step=AdaptiveChunkSize(start=1000)))
+    client = await aiohttp_client(app)
+    resp = await client.get('/')
+    assert await resp.read() == content
+    resp = await client.get('/', headers={'Range': 'bytes=5000-70000'})
+    assert await resp.read() == content[5000:70001]
+
+
+def test_chunk_sizes():
+    from itertools import islice
+    from aiohttp_send import (AdaptiveChunkSize, FileSizeChunkSize,
+                              FixedChunkSize)
+    from aiohttp_send.chunks import as_chunk_size
+
+    assert list(islice(FixedChunkSize(10).sizes(100), 3)) == [10, 10, 10]
+    assert as_chunk_size(10).step == 10
+    strategy = FileSizeChunkSize(reads=4, minimum=10, maximum=100)
+    assert next(strategy.sizes(200)) == 50
+    assert next(strategy.sizes(8)) == 10
+    assert next(strategy.sizes(10000)) == 100
+    strategy = AdaptiveChunkSize(start=10, maximum=50, factor=2)
+    assert list(islice(strategy.sizes(None), 4)) == [10, 20, 40, 50]
+    with pytest.raises(ValueError):
+        FileSizeChunkSize(reads=0)
+
+
+async def test_compress_on_the_fly(aiohttp_client, tmp_path):
+    import gzip
+    from aiohttp_send import Compressor
+    compressor = Compressor(min_size=100, directory=str(tmp_path / 'cache'))
+    content = 'hello world\n' * 100
+    (tmp_path / 'a.txt').write_text(content)
+    (tmp_path / 'small.txt').write_text('hello')
+    (tmp_path / 'a.bin').write_text(content)
+
+    async def handler(r):
+        return await send(r, r.match_info['name'], root=str(tmp_path),
+                          compress=compressor)
+
+    app = web.Application()
+    app.router.add_get('/{name}', handler)
+    client = await aiohttp_client(app, auto_decompress=False)
+    for _ in range(2):
+        resp = await client.get('/a.txt', headers={'Accept-Encoding': 'gzip'})
+        assert resp.status == 200
+        assert resp.headers['Content-Encoding'] == 'gzip'
+        assert resp.headers['Vary'] == 'Accept-Encoding'
+        assert resp.headers['content-type'] == 'text/plain'
+        assert resp.headers['ETag'].endswith('-gzip"')
+        body = await resp.read()
+        assert len(body) == int(resp.headers['Content-Length'])
+        assert gzip.decompress(body).decode() == content
+    assert compressor.cache.hits == 1
+    assert len(os.listdir(str(tmp_path / 'cache'))) == 1
+
+    resp = await client.get('/a.txt', headers={
+        'Accept-Encoding': 'gzip', 'If-None-Match': resp.headers['ETag']})
+    assert resp.status == 304
+
+    resp = await client.get('/a.txt', headers={'Accept-Encoding': 'gzip',
+                                               'Range': 'bytes=0-9'})
+    assert resp.status == 206
+    assert await resp.read() == body[:10]
+
+    for name in ('/small.txt', '/a.bin'):
+        resp = await client.get(name, headers={'Accept-Encoding': 'gzip'})
+        assert 'Content-Encoding' not in resp.headers
+
+    resp = await client.get('/a.txt', headers={'Accept-Encoding': 'identity'})
+    assert 'Content-Encoding' not in resp.headers
+    assert await resp.text() == content
+
+
+def test_compress_file_concurrent(tmp_path):
+    import gzip
+    from concurrent.futures import ThreadPoolExecutor
+    from aiohttp_send.compress import compress_file
+    content = os.urandom(512 * 1024)
+    (tmp_path / 'a.bin').write_bytes(content)
+    cache_path = str(tmp_path / 'a.gz')
+    with ThreadPoolExecutor(4) as executor:
+        for _ in range(10):
+            futures = [executor.submit(compress_file, str(tmp_path / 'a.bin'),
+                                       'gzip', 1, cache_path)
+                       for _ in range(4)]
+            for future in futures:
+                assert gzip.decompress(future.result()) == content
+            os.remove(cache_path)
+    assert os.listdir(str(tmp_path)) == ['a.bin']
+
+
+def test_compress_directory_pruned(tmp_path):
+    import time
+    from aiohttp_send.compress import STALE_TMP_AGE, prune_directory
+    now = time.time()
+    for i in range(4):
+        (tmp_path / '{}.gzip'.format(i)).write_bytes(b'x' * 100)
+        os.utime(str(tmp_path / '{}.gzip'.format(i)), (now + i, now + i))
+    (tmp_path / 'left.tmp').write_bytes(b'x' * 10)
+    os.utime(str(tmp_path / 'left.tmp'),
+             (now - STALE_TMP_AGE - 1, now - STALE_TMP_AGE - 1))
+    assert prune_directory(str(tmp_path), 250) == 210
+    assert sorted(os.listdir(str(tmp_path))) == ['2.gzip', '3.gzip']
+
+
+async def test_compress_prefers_brotli(aiohttp_client, tmp_path):
+    brotli = pytest.importorskip('brotli')
+    from aiohttp_send import Compressor
+    content = 'hello world\n' * 100
+    (tmp_path / 'a.txt').write_text(content)
+    app = web.Application()
+    app.router.add_get('/', wrapper('a.txt', root=str(tmp_path),
+                                    compress=Compressor(min_size=100)))
+    client = await aiohttp_client(app, auto_decompress=False)
+    resp = await client.get('/', headers={'Accept-Encoding': 'gzip, br'})
+    assert resp.headers['Content-Encoding'] == 'br'
+    assert brotli.decompress(await resp.read()).decode() == content
+
+
+async def test_compress_skips_precompressed(aiohttp_client):
+    from aiohttp_send import Compressor
+    compressor = Compressor(min_size=1)
+    app = web.Application()
+    app.router.add_get('/', wrapper('/tests/fixtures/gzip.json',
+                                    compress=compressor))
+    client = await aiohttp_client(app)
+    resp = await client.get('/', headers={'Accept-Encoding': 'gzip'})
+    assert resp.headers['Content-Length'] == '48'
+    assert len(compressor.cache) == 0
+
+
+async def test_accept_encoding_q_values(aiohttp_client):
+    app = web.Application()
+    app.router.add_get('/', wrapper('/tests/fixtures/gzip.json'))
+    client = await aiohttp_client(app)
+    cases = {
+        'br;q=0, gzip': '48',
+        'gzip;q=1, br;q=0.5': '48',
+        'gzip;q=0.5, br': '22',
+        '*': '22',
+        '*;q=0.5, br;q=0': '48',
+        'gzip;q=0, identity': '18',
+        'br;q=0, gzip;q=0': '18',
+    }
+    for accept_encoding, length in cases.items():
+        resp = await client.get('/', headers={
+            'Accept-Encoding': accept_encoding})
+        assert resp.headers['Content-Length'] == length, accept_encoding
+        assert resp.headers['Content-Type'] == 'application/json'
+
+
+async def test_identity_refused(aiohttp_client):
+    from aiohttp_send.negotiation import identity_acceptable
+    assert identity_acceptable('')
+    assert identity_acceptable('gzip, *;q=0, identity')
+    assert not identity_acceptable('gzip, identity;q=0')
+    assert not identity_acceptable('*;q=0')
+    app = web.Application()
+    app.router.add_get('/json', wrapper('/tests/fixtures/gzip.json'))
+    app.router.add_get('/txt', wrapper('/tests/fixtures/user.txt'))
+    client = await aiohttp_client(app, auto_decompress=False)
+    resp = await client.get('/json', headers={
+        'Accept-Encoding': 'gzip, identity;q=0'})
+    assert resp.status == 200
+    assert resp.headers['Content-Encoding'] == 'gzip'
+    resp = await client.get('/txt', headers={
+        'Accept-Encoding': 'gzip, identity;q=0'})
+    assert resp.status == 406
+    resp = await client.get('/txt', headers={'Accept-Encoding': '*;q=0'})
+    assert resp.status == 406
+
+
+async def test_zstd_precompressed(aiohttp_client, tmp_path):
+    (tmp_path / 'a.json').write_text('{}')
+    (tmp_path / 'a.json.zst').write_bytes(b'zstd data')
+    app = web.Application()
+    app.router.add_get('/', wrapper('a.json', root=str(tmp_path)))
+    client = await aiohttp_client(app, auto_decompress=False)
+    resp = await client.get('/', headers={'Accept-Encoding': 'gzip, zstd'})
+    assert resp.headers['Content-Encoding'] == 'zstd'
+    assert resp.headers['Content-Type'] == 'application/json'
+    assert await resp.read() == b'zstd data'
+
+    app = web.Application()
+    app.router.add_get('/', wrapper('a.json', root=str(tmp_path), zstd=False))
+    client = await aiohttp_client(app, auto_decompress=False)
+    resp = await client.get('/', headers={'Accept-Encoding': 'zstd'})
+    assert 'Content-Encoding' not in resp.headers
+
+
+def test_negotiate_encoding():
+    from aiohttp_send.negotiation import (negotiate_encoding,
+                                          parse_accept_encoding)
+    assert parse_accept_encoding('gzip;q=0.5, BR ; q=1.0, x;q=bad') == {
+        'gzip': 0.5, 'br': 1.0, 'x': 0.0}
+    available = ['br', 'zstd', 'gzip']
+    assert negotiate_encoding('', available) == ()
+    assert negotiate_encoding('gzip, br', available) == ('br', 'gzip')
+    assert negotiate_encoding('gzip, br;q=0.9', available) == ('gzip', 'br')
+    assert negotiate_encoding('*, gzip;q=0', available) == ('br', 'zstd')
+    assert negotiate_encoding('identity', available) == ()
+
+
+async def test_manifest(aiohttp_client, tmp_path):
+    from aiohttp_send import Manifest
+    manifest = await Manifest.build(str(fixtures_root), index='index.html',
+                                    extensions=['json', 'txt'])
+    assert 'hello.txt' in manifest.files
+    assert not any(name.startswith('.') for name in manifest.files)
+    manifest.dump(str(tmp_path / 'manifest.json'))
+    loaded = Manifest.load(str(tmp_path / 'manifest.json'),
+                           str(fixtures_root))
+
+    for m in (manifest, loaded):
+        async def handler(r):
+            return await send(r, r.match_info['tail'], manifest=m)
+
+        app = web.Application()
+        app.router.add_get('/{tail:.*}', handler)
+        client = await aiohttp_client(app)
+
+        resp = await client.get('/hello.txt')
+        assert resp.status == 200
+        assert 'world' in await resp.text()
+        resp = await client.get('/user')
+        assert resp.headers['content-type'] == 'application/json'
+        resp = await client.get('/world')
+        assert 'html index' in await resp.text()
+        resp = await client.get('/world/')
+        assert 'html index' in await resp.text()
+        resp = await client.get('/gzip.json',
+                                headers={'Accept-Encoding': 'gzip'})
+        assert resp.headers['Content-Length'] == '48'
+        for missing in ('/missing.txt', '/.hidden', '/some.path'):
+            resp = await client.get(missing)
+            assert resp.status == 404
+        await client.close()
+
+
+async def test_path_cache_invalidate(aiohttp_client, tmp_path):
+    import gzip
+    from aiohttp_send import PathCache
+    cache = PathCache()
+    (tmp_path / 'a.json').write_text('{}')
+    (tmp_path / 'b.txt').write_text('b')
+    (tmp_path / 'c.txt').write_text('c')
+    (tmp_path / 'c.txt.br').write_bytes(b'br')
+
+    async def handler(request):
+        return await send(request, request.match_info['name'],
+                          root=str(tmp_path), extensions=['json'],
+                          cache=cache)
+
+    app = web.Application()
+    app.router.add_get('/{name}', handler)
+    client = await aiohttp_client(app)
+    gz = {'Accept-Encoding': 'gzip'}
+    for url, headers in (('/a', {}), ('/b.txt', gz),
+                         ('/c.txt', {'Accept-Encoding': 'br'})):
+        resp = await client.get(url, headers=headers)
+        assert resp.status == 200
+    assert len(cache) == 3
+    cache.invalidate([str(tmp_path / 'a.json')])
+    assert len(cache) == 2
+    # a new precompressed sibling changes resolution of b.txt
+    (tmp_path / 'b.txt.gz').write_bytes(gzip.compress(b'b'))
+    cache.invalidate([str(tmp_path / 'b.txt.gz')])
+    assert len(cache) == 1
+    resp = await client.get('/b.txt', headers=gz)
+    assert resp.headers['Content-Encoding'] == 'gzip'
+    cache.invalidate([str(tmp_path / 'c.txt.br')])
+    assert len(cache) == 1
+    await client.close()
+
+
+@pytest.mark.parametrize('inotify', [False, None])
+async def test_watcher_invalidates(tmp_path, inotify):
+    import asyncio
+    from aiohttp_send import ContentCache, Watcher
+    from aiohttp_send.send import FileState
+    if inotify is None and not Watcher([], [], inotify=None).uses_inotify:
+        pytest.skip('inotify not available')
+    file_path = str(tmp_path / 'a.txt')
+    (tmp_path / 'a.txt').write_text('a')
+    cache = ContentCache()
+    watcher = Watcher([str(tmp_path)], [cache], delay=0.05, interval=0.05,
+                      inotify=inotify)
+    await watcher.start()
+    try:
+        cache.set_body(file_path, FileState(1, 1, False), b'a')
+        cache.set_body(str(tmp_path / 'b.txt'), FileState(1, 1, False), b'b')
+        (tmp_path / 'a.txt').write_text('changed')
+        for _ in range(50):
+            await asyncio.sleep(0.05)
+            if file_path not in cache:
+                break
+        assert file_path not in cache
+        assert str(tmp_path / 'b.txt') in cache
+        assert watcher.batches >= 1
+    finally:
+        await watcher.stop()
+
+
+async def test_watcher_new_directory(tmp_path):
+    import asyncio
+    from aiohttp_send import Watcher
+
+    class Recorder:
+        def __init__(self):
+            self.paths = set()
+            self.cleared = 0
+
+        def invalidate(self, paths):
+            self.paths.update(paths)
+
+        def clear(self):
+            self.cleared += 1
+
+    async def wait_for(p):
+        for _ in range(50):
+            if p in recorder.paths:
+                return
+            await asyncio.sleep(0.05)
+
+    root = tmp_path / 'root'
+    root.mkdir()
+    (tmp_path / 'new' / 'sub').mkdir(parents=True)
+    (tmp_path / 'new' / 'sub' / 'a.txt').write_text('a')
+    recorder = Recorder()
+    watcher = Watcher([str(root)], [recorder], delay=0.05)
+    if not watcher.uses_inotify:
+        pytest.skip('inotify not available')
+    await watcher.start()
+    try:
+        os.rename(str(tmp_path / 'new'), str(root / 'new'))
+        moved = str(root / 'new' / 'sub' / 'a.txt')
+        await wait_for(moved)
+        assert moved in recorder.paths
+        # the moved tree is watched, without clearing every cache
+        (root / 'new' / 'sub' / 'b.txt').write_text('b')
+        created = str(root / 'new' / 'sub' / 'b.txt')
+        await wait_for(created)
+        assert created in recorder.paths
+        assert recorder.cleared == 0
+    finally:
+        await watcher.stop()
+
+
+async def test_watcher_coalesces_bursts():
+    import asyncio
+    from aiohttp_send import ContentCache, Watcher
+    from aiohttp_send.send import FileState
+    cache = ContentCache()
+    cache.set_body('/r/keep', FileState(1, 1, False), b'a')
+    watcher = Watcher(['/r'], [cache], delay=0.01, max_batch=10,
+                      inotify=False)
+    watcher.notify(['/r/a'])
+    watcher.notify(['/r/b'])
+    await asyncio.sleep(0.05)
+    assert watcher.batches == 1
+    assert watcher.invalidations == 2
+    assert '/r/keep' in cache
+
+    watcher.notify('/r/{}'.format(i) for i in range(100))
+    await asyncio.sleep(0.05)
+    assert watcher.batches == 2
+    assert len(cache) == 0
+
+
+async def test_dir_index_missing_404(aiohttp_client):
+    app = web.Application()
+    app.router.add_get('/', wrapper('fixtures/some.path', root='tests',
+                                    index='index.html'))
+    client = await aiohttp_client(app)
+    resp = await client.get('/')
+    assert resp.status == 404
+
+
+async def test_resolve_single_executor_job(aiohttp_client, monkeypatch):
+    send_module = sys.modules['aiohttp_send.send']
+    calls = []
+    original = send_module.resolve_path
+
+    async def counting(*args, **kwargs):
+        calls.append(args)
+        return await original(*args, **kwargs)
+
+    monkeypatch.setattr(send_module, 'resolve_path', counting)
+    app = web.Application()
+    app.router.add_get('/', wrapper('world', root=str(fixtures_root),
+                                    index='index.html',
+                                    extensions=['json', 'txt']))
+    client = await aiohttp_client(app)
+    resp = await client.get('/', headers={'Accept-Encoding': 'br, gzip'})
+    assert resp.status == 200
+    assert await resp.read() == \
+        (fixtures_root / 'world' / 'index.html').read_bytes()
+    assert len(calls) == 1
+
+
+async def test_io_pool(aiohttp_client):
+    from concurrent.futures import ThreadPoolExecutor
+    from aiohttp_send import IOPool
+    executor = ThreadPoolExecutor(2)
+    pool = IOPool(executor=executor, max_streams=1)
+    app = web.Application()
+    app.router.add_get('/', wrapper('/tests/fixtures/user.json',
+                                    sendfile=False, pool=pool))
+    client = await aiohttp_client(app)
+    resp = await client.get('/')
+    assert resp.status == 200
+    assert '{ "name": "tobi" }' == await resp.text()
+    await client.close()
+    assert pool.stats()['active'] == 0
+    executor.shutdown()
+
+
+async def test_io_pool_saturated():
+    import asyncio
+    from aiohttp_send import IOPool
+    pool = IOPool(max_streams=1, max_queue=1, timeout=0.05)
+    await pool.acquire()
+    waiter = asyncio.ensure_future(pool.acquire())
+    await asyncio.sleep(0)
+    assert pool.waiting == 1
+    # queue is full
+    with pytest.raises(web.HTTPServiceUnavailable):
+        await pool.acquire()
+    pool.release()
+    await waiter
+    assert pool.active == 1
+    # waited too long
+    with pytest.raises(web.HTTPServiceUnavailable):
+        await pool.acquire()
+    assert pool.stats()['rejected'] == 2
+    pool.release()
+    pool.close()
+
+
+async def test_fd_cache(aiohttp_client, tmp_path):
+    from aiohttp_send import DescriptorCache
+    content = os.urandom(300 * 1024)
+    (tmp_path / 'blob.bin').write_bytes(content)
+    cache = DescriptorCache(maxsize=1, min_size=1024)
+    for sendfile in (True, False):
+        app = web.Application()
+        app.router.add_get('/', wrapper('blob.bin', root=str(tmp_path),
+                                        fd_cache=cache, sendfile=sendfile))
+        client = await aiohttp_client(app)
+        resp = await client.get('/')
+        assert await resp.read() == content
+        resp = await client.get('/', headers={'Range': 'bytes=100-200,-10'})
+        body = await resp.read()
+        assert content[100:201] in body
+        assert content[-10:] in body
+        await client.close()
+    assert cache.misses == 1
+    assert cache.hits == 3
+    descriptor = cache.get(str(tmp_path / 'blob.bin'))
+    assert descriptor.refs == 0
+    assert not descriptor.file.closed
+
+    (tmp_path / 'blob.bin').write_bytes(b'new' * 1024)
+    app = web.Application()
+    app.router.add_get('/', wrapper('blob.bin', root=str(tmp_path),
+                                    fd_cache=cache))
+    client = await aiohttp_client(app)
+    resp = await client.get('/')
+    assert await resp.read() == b'new' * 1024
+    assert descriptor.file.closed
+
+
+async def test_fd_cache_eviction_waits_for_release(tmp_path):
+    from aiohttp_send import DescriptorCache
+    from aiohttp_send.send import FileState
+    for name in ('a', 'b'):
+        (tmp_path / name).write_bytes(b'x' * 10)
+    cache = DescriptorCache(maxsize=1, min_size=1)
+    a = str(tmp_path / 'a')
+    descriptor = await cache.acquire(a, FileState.from_stat(os.stat(a)))
+    b = str(tmp_path / 'b')
+    cache.release(await cache.acquire(b, FileState.from_stat(os.stat(b))))
+    assert a not in cache
+    assert not descriptor.file.closed
+    assert os.pread(descriptor.file.fileno(), 3, 0) == b'xxx'
+    cache.release(descriptor)
+    assert descriptor.file.closed
+    cache.clear()
+
+
+async def test_mmap_cache(aiohttp_client, tmp_path):
+    from aiohttp_send import MmapCache
+    content = os.urandom(300 * 1024)
+    (tmp_path / 'blob.bin').write_bytes(content)
+    cache = MmapCache(min_size=1024)
+    app = web.Application()
+    app.router.add_get('/', wrapper('blob.bin', root=str(tmp_path),
+                                    mmap_cache=cache))
+    client = await aiohttp_client(app)
+    resp = await client.get('/')
+    assert await resp.read() == content
+    resp = await client.get('/', headers={'Range': 'bytes=100-200'})
+    assert await resp.read() == content[100:201]
+    resp = await client.get('/', headers={'Range': 'bytes=0-9,-10'})
+    body = await resp.read()
+    assert content[:10] in body and content[-10:] in body
+    assert cache.misses == 1
+    assert cache.hits == 2
+    assert cache.currsize == len(content)
+
+    # replaced file is mapped again
+    (tmp_path / 'new.bin').write_bytes(b'new' * 1024)
+    os.replace(str(tmp_path / 'new.bin'), str(tmp_path / 'blob.bin'))
+    resp = await client.get('/')
+    assert await resp.read() == b'new' * 1024
+    assert cache.currsize == 3 * 1024
+    await client.close()
+    cache.clear()
+
+
+async def test_mmap_cache_eviction(tmp_path):
+    from aiohttp_send import MmapCache
+    from aiohttp_send.send import FileState
+    for name in 'ab':
+        (tmp_path / name).write_bytes(name.encode() * 4096)
+    cache = MmapCache(maxsize=4096, min_size=0)
+    a = str(tmp_path / 'a')
+    mapping = await cache.acquire(a, FileState.from_stat(os.stat(a)))
+    assert bytes(mapping.view[:2]) == b'aa'
+    b = str(tmp_path / 'b')
+    other = await cache.acquire(b, FileState.from_stat(os.stat(b)))
+    # evicted while in use, closed on release
+    assert mapping.evicted and not mapping.map.closed
+    cache.release(mapping)
+    assert mapping.map.closed
+    cache.release(other)
+    assert not other.map.closed
+    cache.clear()
+    assert other.map.closed
+
+
+async def test_metrics(aiohttp_client):
+    from aiohttp_send import Metrics, PathCache
+    cache = PathCache()
+    metrics = Metrics(caches={'path': cache})
+    app = web.Application()
+
+    async def handler(request):
+        name = request.query.get('path', request.match_info['name'])
+        return await send(request, name, root='tests/fixtures', cache=cache,
+                          observer=metrics)
+
+    app.router.add_get('/metrics', metrics.handler)
+    app.router.add_get('/{name:.*}', handler)
+    client = await aiohttp_client(app)
+    resp = await client.get('/hello.txt')
+    assert resp.status == 200
+    etag = resp.headers['ETag']
+    body = await resp.read()
+    resp = await client.get('/hello.txt', headers={'If-None-Match': etag})
+    assert resp.status == 304
+    resp = await client.get('/missing.txt')
+    assert resp.status == 404
+    resp = await client.get('/', params={'path': '../setup.py'})
+    assert resp.status == 403
+    resp = await client.get('/gzip.json',
+                            headers={'Accept-Encoding': 'gzip'})
+    assert resp.headers['Content-Encoding'] == 'gzip'
+    gzipped = resp.headers['Content-Length']
+    resp = await client.get('/metrics')
+    assert resp.headers['Content-Type'].startswith('text/plain')
+    # wait for handlers to finish
+    await client.close()
+
+    stats = metrics.stats()
+    assert stats['responses'] == {200: 2, 304: 1, 403: 1, 404: 1}
+    assert stats['bytes_sent'] == {'identity': len(body),
+                                   'gzip': int(gzipped)}
+    assert stats['io']['resolve'] == 3
+    assert stats['caches']['path']['hits'] == 1
+    assert metrics.prepare_seconds.count == 2
+    assert metrics.body_seconds.count == 2
+
+    text = metrics.exposition()
+    assert 'aiohttp_send_responses_total{status="404"} 1' in text
+    assert 'aiohttp_send_sent_bytes_total{encoding="gzip"} ' + gzipped in text
+    assert 'aiohttp_send_prepare_seconds_bucket{le="+Inf"} 2' in text
+    assert 'aiohttp_send_cache_hits_total{cache="path"} 1' in text
+
+
+async def test_metrics_saturated_and_listing(aiohttp_client):
+    from aiohttp_send import DirectoryListing, IOPool, Metrics
+    metrics = Metrics()
+    pool = IOPool(max_streams=1, max_queue=0)
+
+    async def handler(r):
+        return await send(r, r.match_info['name'] or '/',
+                          root='tests/fixtures', pool=pool,
+                          listing=DirectoryListing(), observer=metrics)
+
+    app = web.Application()
+    app.router.add_get('/{name:.*}', handler)
+    client = await aiohttp_client(app)
+    resp = await client.get('/world/')
+    assert resp.status == 200
+    assert resp.headers['Content-Type'] == 'text/html; charset=utf-8'
+    body = await resp.read()
+    await pool.acquire()
+    resp = await client.get('/user.json')
+    assert resp.status == 503
+    pool.release()
+    await client.close()
+    pool.close()
+
+    stats = metrics.stats()
+    assert stats['responses'] == {200: 1, 503: 1}
+    assert stats['bytes_sent'] == {'identity': len(body)}
+
+
+async def test_static_files(aiohttp_client):
+    from aiohttp_send import StaticFiles
+    handler = StaticFiles('tests/fixtures', index='index.html',
+                          extensions=['json', '.txt'], max_age=60,
+                          immutable=True)
+    assert handler.options.root == abspath(fixtures_root)
+    assert handler.options.extensions == ('.json', '.txt')
+    assert handler.options.cache_control == 'max-age=60, immutable'
+    app = web.Application()
+    handler.add_routes(app.router, '/static/')
+    client = await aiohttp_client(app)
+    resp = await client.get('/static/hello')
+    assert resp.status == 200
+    assert await resp.text() == 'world'
+    assert resp.headers['Cache-Control'] == 'max-age=60, immutable'
+    resp = await client.get('/static/world/')
+    assert resp.status == 200
+    resp = await client.head('/static/user')
+    assert resp.headers['Content-Type'] == 'application/json'
+    resp = await client.get('/static/missing')
+    assert resp.status == 404
+    await client.close()
+
+
+async def test_static_files_decoded_once(aiohttp_client, tmp_path):
+    from aiohttp_send import StaticFiles
+    (tmp_path / 'a+b.txt').write_text('plus')
+    (tmp_path / '100%.txt').write_text('percent')
+    app = web.Application()
+    StaticFiles(str(tmp_path)).add_routes(app.router, '/s')
+    client = await aiohttp_client(app)
+    for url, text in (('/s/a%2Bb.txt', 'plus'), ('/s/a+b.txt', 'plus'),
+                      ('/s/100%25.txt', 'percent')):
+        resp = await client.get(url)
+        assert resp.status == 200, url
+        assert await resp.text() == text
+    resp = await client.get('/s/%252e%252e/x')
+    assert resp.status == 404
+    await client.close()
+
+
+def test_static_files_options():
+    from aiohttp_send import StaticFiles
+    with pytest.raises(ValueError):
+        StaticFiles('tests/fixtures', extensions=[1])
+    with pytest.raises(ValueError):
+        StaticFiles('tests/fixtures', set_headers='nope')
+
+
+def test_normalize_path():
+    send_module = sys.modules['aiohttp_send.send']
+    normalize_path = send_module.normalize_path
+    root = '/srv/public'
+    assert normalize_path(root, root + '/', '/a/./b//c.txt') == \
+        ('/srv/public/a/b/c.txt', False)
+    assert normalize_path(root, root + '/', 'a/b/') == \
+        ('/srv/public/a/b', True)
+    assert normalize_path(root, root + '/', '') == (root, True)
+    for bad in ('../public2/x', 'a/../../x', '%2e%2e/x', '.%2E/x',
+                'a/%2e%2e', 'a%2f..%2fb', 'a\x00b', 'a%00b'):
+        with pytest.raises(web.HTTPForbidden):
+            normalize_path(root, root + '/', bad)
+
+
+def test_normalize_path_fuzz():
+    import random
+    send_module = sys.modules['aiohttp_send.send']
+    rng = random.Random(0)
+    pieces = ['a', 'b.txt', '.', '..', '%2e', '%2E%2e', '.%2e', '%2f',
+              '/', '//', '\\', '%5c', '\x00', '%00', '+', '%20', '2']
+    root = '/srv/public'
+    for _ in range(5000):
+        file_path = ''.join(rng.choice(pieces)
+                            for _ in range(rng.randint(0, 8)))
+        try:
+            result, _ = send_module.normalize_path(root, root + '/',
+                                                   file_path)
+        except web.HTTPForbidden:
+            continue
+        assert result == root or result.startswith(root + '/'), file_path
+        assert '\x00' not in result
+        assert '..' not in result.split('/'), file_path
+        assert path.normpath(result) == result, file_path
+
+
+@pytest.mark.parametrize('archive', ['tar', 'zip'])
+@pytest.mark.parametrize('sendfile', [True, False])
+async def test_send_archive(aiohttp_client, archive, sendfile):
+    import io
+    import tarfile
+    import zipfile
+    from aiohttp_send import send_archive
+
+    async def handler(request):
+        return await send_archive(request, request.query.getall('path'),
+                                  root='tests/fixtures', archive=archive,
+                                  sendfile=sendfile)
+
+    app = web.Application()
+    app.router.add_get('/', handler)
+    client = await aiohttp_client(app)
+    resp = await client.get('/', params=[('path', 'hello.txt'),
+                                         ('path', 'world'),
+                                         ('path', '/some.path/')])
+    assert resp.status == 200
+    body = await resp.read()
+    assert len(body) == int(resp.headers['Content-Length'])
+    assert resp.headers['Content-Disposition'] == \
+        'attachment; filename="archive.{}"'.format(archive)
+    expected = {
+        'hello.txt': b'world',
+        'world/index.html': (fixtures_root / 'world' / 'index.html')
+        .read_bytes(),
+        'some.path/index.json': (fixtures_root / 'some.path' / 'index.json')
+        .read_bytes(),
+    }
+    if archive == 'tar':
+        with tarfile.open(fileobj=io.BytesIO(body)) as t:
+            got = {m.name: t.extractfile(m).read() for m in t.getmembers()}
+    else:
+        with zipfile.ZipFile(io.BytesIO(body)) as z:
+            assert z.testzip() is None
+            got = {name: z.read(name) for name in z.namelist()}
+    assert got == expected
+
+    resp = await client.get('/', params={'path': '../setup.py'})
+    assert resp.status == 403
+    resp = await client.get('/', params={'path': 'missing.txt'})
+    assert resp.status == 404
+    await client.close()
+
+
+@pytest.mark.parametrize('archive', ['tar', 'zip'])
+@pytest.mark.parametrize('change', ['shrink', 'grow'])
+async def test_send_archive_file_changed(aiohttp_client, tmp_path,
+                                         monkeypatch, archive, change):
+    import aiohttp
+    from aiohttp_send import send_archive
+    archive_module = sys.modules['aiohttp_send.archive']
+    original = archive_module._collect
+    (tmp_path / 'a.txt').write_bytes(b'a' * 10)
+    (tmp_path / 'b.txt').write_bytes(b'b' * 10)
+
+    def collect(*args):
+        entries = original(*args)
+        # changed after its size went into Content-Length
+        (tmp_path / 'b.txt').write_bytes(
+            b'b' * 5 if change == 'shrink' else b'b' * 20)
+        return entries
+
+    monkeypatch.setattr(archive_module, '_collect', collect)
+
+    async def handler(request):
+        return await send_archive(request, ['a.txt', 'b.txt'],
+                                  root=str(tmp_path), archive=archive)
+
+    app = web.Application()
+    app.router.add_get('/', handler)
+    client = await aiohttp_client(app)
+    resp = await client.get('/')
+    assert resp.status == 200
+    with pytest.raises(aiohttp.ClientPayloadError):
+        await asyncio.wait_for(resp.read(), 5)
+    await client.close()
+
+
+@pytest.mark.parametrize('archive', ['tar', 'zip'])
+@pytest.mark.parametrize('sendfile', [True, False])
+async def test_send_archive_file_grows_while_sent(aiohttp_client, tmp_path,
+                                                  monkeypatch, archive,
+                                                  sendfile):
+    import io
+    import tarfile
+    import zipfile
+    from aiohttp_send import send_archive
+    archive_module = sys.modules['aiohttp_send.archive']
+    original = archive_module.write_file
+    (tmp_path / 'a.txt').write_bytes(b'a' * 10)
+
+    async def write_file(request, resp, file_path, *args, **kwargs):
+        with open(file_path, 'ab') as f:
+            f.write(b'more')
+        return await original(request, resp, file_path, *args, **kwargs)
+
+    monkeypatch.setattr(archive_module, 'write_file', write_file)
+
+    async def handler(request):
+        return await send_archive(request, ['a.txt'], root=str(tmp_path),
+                                  archive=archive, sendfile=sendfile)
+
+    app = web.Application()
+    app.router.add_get('/', handler)
+    client = await aiohttp_client(app)
+    resp = await client.get('/')
+    body = await resp.read()
+    assert len(body) == int(resp.headers['Content-Length'])
+    if archive == 'tar':
+        with tarfile.open(fileobj=io.BytesIO(body)) as t:
+            assert t.extractfile('a.txt').read() == b'a' * 10
+    else:
+        with zipfile.ZipFile(io.BytesIO(body)) as z:
+            assert z.testzip() is None
+            assert z.read('a.txt') == b'a' * 10
+    await client.close()
+
+
+def test_zip64_records():
+    import zipfile
+    from aiohttp_send.archive import ZipWriter
+    from aiohttp_send.send import FileState
+    writer = ZipWriter()
+    big = FileState(0, 5 * 1024 ** 3, False)
+    entries = [('big.bin', '', big)]
+    # header without reading 5GiB, crc of empty content
+    writer.records.append((b'big.bin', big.st_size, 0, 0, 33, 0))
+    writer.offset = writer._local_length('big.bin', big) + big.st_size
+    end = writer.end()
+    assert writer.length(entries) == writer.offset + len(end)
+    assert end[-22:-18] == b'PK\x05\x06'
+    assert b'PK\x06\x06' in end
+    assert zipfile.ZIP64_LIMIT < big.st_size
+
+
+def test_archive_content_disposition():
+    from urllib.parse import unquote
+    from aiohttp_send.archive import content_disposition
+    assert content_disposition('a.zip') == 'attachment; filename="a.zip"'
+    assert content_disposition('say "hi".tar') == \
+        'attachment; filename="say _hi_.tar"; ' \
+        "filename*=UTF-8''say%20%22hi%22.tar"
+    for name in ('résumé.zip', 'a\\b\r\n.zip'):
+        value = content_disposition(name)
+        assert value.isascii() and '\r' not in value
+        assert unquote(value.split("UTF-8''")[1]) == name
+
+
+async def test_directory_listing(aiohttp_client, tmp_path):
+    from aiohttp_send import DirectoryListing
+    (tmp_path / 'sub').mkdir()
+    (tmp_path / 'sub' / 'a b.txt').write_bytes(b'12345')
+    (tmp_path / 'sub' / '.secret').write_bytes(b'')
+    (tmp_path / 'sub' / 'inner').mkdir()
+    (tmp_path / 'indexed').mkdir()
+    (tmp_path / 'indexed' / 'index.html').write_bytes(b'index')
+    listing = DirectoryListing(page_size=1)
+
+    async def handler(request):
+        return await send(request, request.match_info['name'] or '/',
+                          root=str(tmp_path), index='index.html',
+                          listing=listing)
+
+    app = web.Application()
+    app.router.add_get('/{name:.*}', handler)
+    client = await aiohttp_client(app)
+    resp = await client.get('/sub/')
+    assert resp.headers['Content-Type'] == 'text/html; charset=utf-8'
+    text = await resp.text()
+    assert '<a href="inner/">inner/</a>' in text
+    assert '<a href="a%20b.txt">a b.txt</a> 5' in text
+    assert '.secret' not in text
+    assert text.index('inner/') < text.index('a b.txt')
+
+    resp = await client.get('/sub', headers={'Accept': 'application/json'})
+    assert resp.headers['Content-Type'] == 'application/json'
+    entries = await resp.json()
+    assert [(e['name'], e['type'], e['size']) for e in entries] == [
+        ('inner', 'directory', 0), ('a b.txt', 'file', 5)]
+    assert listing.misses == 1 and listing.hits == 1
+
+    # a new entry changes directory mtime
+    os.utime(str(tmp_path / 'sub'), (0, 0))
+    (tmp_path / 'sub' / 'c.txt').write_bytes(b'')
+    resp = await client.get('/sub', headers={'Accept': 'application/json'})
+    assert len(await resp.json()) == 3
+
+    resp = await client.get('/indexed/')
+    assert await resp.text() == 'index'
+    resp = await client.get('/', headers={'Accept': 'application/json'})
+    assert {e['name'] for e in await resp.json()} == {'sub', 'indexed'}
+    await client.close()
+
+
+async def test_directory_listing_etag(aiohttp_client, tmp_path):
+    from aiohttp_send import DirectoryListing
+    (tmp_path / 'a.txt').write_bytes(b'a')
+    (tmp_path / '.b').write_bytes(b'b')
+    listing = DirectoryListing()
+
+    async def handler(request):
+        return await send(request, '/', root=str(tmp_path), listing=listing,
+                          hidden=request.query.get('hidden') != '0')
+
+    app = web.Application()
+    app.router.add_get('/', handler)
+    client = await aiohttp_client(app)
+    resp = await client.get('/')
+    assert resp.headers['Vary'] == 'Accept'
+    etag = resp.headers['ETag']
+
+    # same If-None-Match, other format
+    json_headers = {'Accept': 'application/json', 'If-None-Match': etag}
+    resp = await client.get('/', headers=json_headers)
+    assert resp.status == 200
+    assert resp.headers['Vary'] == 'Accept'
+    assert [e['name'] for e in await resp.json()] == ['a.txt']
+    json_etag = resp.headers['ETag']
+    assert json_etag != etag
+
+    resp = await client.get('/', headers={'If-None-Match': etag})
+    assert resp.status == 304
+    assert resp.headers['Vary'] == 'Accept'
+    json_headers['If-None-Match'] = json_etag
+    resp = await client.get('/', headers=json_headers)
+    assert resp.status == 304
+
+    # hidden entries shown
+    resp = await client.get('/?hidden=0', headers=json_headers)
+    assert resp.status == 200
+    assert [e['name'] for e in await resp.json()] == ['.b', 'a.txt']
+    await client.close()
+
+
+async def test_directory_without_listing_404(aiohttp_client):
+    app = web.Application()
+    app.router.add_get('/', wrapper('tests/fixtures/world/'))
+    client = await aiohttp_client(app)
+    resp = await client.get('/')
+    assert resp.status == 404
+    await client.close()
+
+
+async def test_single_flight():
+    from aiohttp_send import SingleFlight
+    flight = SingleFlight(timeout=0.5)
+    calls = []
+
+    async def slow(value, delay=0.05):
+        calls.append(value)
+        await asyncio.sleep(delay)
+        if value == 'error':
+            raise OSError(value)
+        return value
+
+    results = await asyncio.gather(*[flight.do('a', slow, 'a')
+                                     for _ in range(10)])
+    assert results == ['a'] * 10
+    assert calls == ['a']
+    assert flight.stats() == {'calls': 1, 'shared': 9, 'in_flight': 0}
+
+    results = await asyncio.gather(
+        *[flight.do('e', slow, 'error') for _ in range(3)],
+        return_exceptions=True)
+    assert all(isinstance(e, OSError) for e in results)
+
+    # a cancelled caller doesn't cancel the call of others
+    first = asyncio.ensure_future(flight.do('b', slow, 'b'))
+    await asyncio.sleep(0)
+    second = asyncio.ensure_future(flight.do('b', slow, 'b'))
+    await asyncio.sleep(0)
+    first.cancel()
+    assert await second == 'b'
+
+    with pytest.raises(web.HTTPServiceUnavailable):
+        await flight.do('c', slow, 'c', delay=1)
+    assert len(flight) == 1
+
+
+async def test_single_flight_send(aiohttp_client, monkeypatch):
+    from aiohttp_send import Compressor, SingleFlight
+    send_module = sys.modules['aiohttp_send.send']
+    original = send_module.resolve_path
+    calls = []
+
+    async def slow_resolve(*args, **kwargs):
+        calls.append(args)
+        await asyncio.sleep(0.05)
+        return await original(*args, **kwargs)
+
+    monkeypatch.setattr(send_module, 'resolve_path', slow_resolve)
+    flight = SingleFlight()
+    app = web.Application()
+    app.router.add_get('/', wrapper('tests/fixtures/user.json',
+                                    flight=flight,
+                                    compress=Compressor(min_size=1)))
+    client = await aiohttp_client(app)
+    responses = await asyncio.gather(*[
+        client.get('/', headers={'Accept-Encoding': 'gzip'})
+        for _ in range(10)])
+    bodies = [await resp.read() for resp in responses]
+    assert all(resp.headers['Content-Encoding'] == 'gzip'
+               for resp in responses)
+    assert len(set(bodies)) == 1
+    assert len(calls) == 1
+    await client.close()
+
+
+def test_precompress(tmp_path, capsys):
+    import gzip
+    from aiohttp_send import Manifest
+    from aiohttp_send.precompress import main, precompress
+    root = tmp_path / 'public'
+    root.mkdir()
+    text = b'hello world, ' * 200
+    (root / 'app.js').write_bytes(text)
+    (root / 'noise.txt').write_bytes(os.urandom(1024))
+    (root / 'photo.png').write_bytes(b'\x89PNG' * 200)
+    (root / 'small.css').write_bytes(b'a{}')
+    (root / '.hidden.js').write_bytes(text)
+
+    totals = precompress(str(root), encodings=['gzip', 'br'],
+                         workers=1)
+    assert totals == {'files': 2, 'written': 2, 'fresh': 0, 'dropped': 2}
+    assert gzip.decompress((root / 'app.js.gz').read_bytes()) == text
+    assert (root / 'app.js.br').exists()
+    assert not (root / 'noise.txt.gz').exists()
+    assert not (root / 'photo.png.gz').exists()
+    assert not (root / 'small.css.gz').exists()
+    assert not (root / '.hidden.js.gz').exists()
+    assert (root / 'app.js.gz').stat().st_mtime == \
+        (root / 'app.js').stat().st_mtime
+
+    # variants are left alone until the original changes
+    manifest = str(tmp_path / 'manifest.json')
+    assert main([str(root), '--encodings', 'gzip', 'br', '--workers',
+                 '1', '--manifest', manifest]) == 0
+    assert '2 up to date' in capsys.readouterr().out
+    os.utime(str(root / 'app.js'),
+             (0, (root / 'app.js').stat().st_mtime + 10))
+    totals = precompress(str(root), encodings=['gzip'], workers=1)
+    assert totals['written'] == 1
+
+    loaded = Manifest.load(manifest, str(root))
+    resolved = loaded.resolve(str(root / 'app.js'), ('br',))
+    assert resolved[0].endswith('app.js.br')
+
+
+async def test_fingerprints(aiohttp_client, tmp_path):
+    import hashlib
+    from aiohttp_send import Fingerprints
+    (tmp_path / 'js').mkdir()
+    (tmp_path / 'js' / 'app.min.js').write_bytes(b'let a = 1')
+    (tmp_path / 'js' / 'app.min.js.gz').write_bytes(b'gz')
+    (tmp_path / 'LICENSE').write_bytes(b'MIT')
+    digest = hashlib.sha256(b'let a = 1').hexdigest()
+    fingerprints = Fingerprints(str(tmp_path), prefix='/static')
+    await fingerprints.build()
+    url = fingerprints.url('js/app.min.js')
+    assert url == '/static/js/app.min.{}.js'.format(digest[:12])
+    assert fingerprints.url('LICENSE').startswith('/static/LICENSE.')
+
+    app = web.Application()
+
+    async def handler(request):
+        return await send(request, request.match_info['name'],
+                          root=str(tmp_path), fingerprints=fingerprints,
+                          max_age=60)
+
+    app.router.add_get('/static/{name:.*}', handler)
+    client = await aiohttp_client(app)
+    resp = await client.get(url, headers={'Accept-Encoding': 'identity'})
+    assert resp.status == 200
+    assert await resp.read() == b'let a = 1'
+    assert resp.headers['Cache-Control'] == 'max-age=31536000, immutable'
+    assert resp.headers['ETag'] == '"{}"'.format(digest)
+    resp = await client.get(url, headers={'Accept-Encoding': 'gzip'})
+    assert resp.headers['ETag'] == '"{}-gzip"'.format(digest)
+    resp = await client.get(url, headers={'If-None-Match': '"{}"'.format(
+        digest), 'Accept-Encoding': 'identity'})
+    assert resp.status == 304
+
+    # plain names are served as usual
+    resp = await client.get('/static/js/app.min.js',
+                            headers={'Accept-Encoding': 'identity'})
+    assert resp.headers['Cache-Control'] == 'max-age=60'
+
+    # old hash is gone once the file changes
+    (tmp_path / 'js' / 'app.min.js').write_bytes(b'let a = 22')
+    # even when its precompressed sibling is sent
+    (tmp_path / 'js' / 'app.min.js.gz').write_bytes(b'new gz')
+    resp = await client.get(url, headers={'Accept-Encoding': 'gzip'})
+    assert resp.status == 404
+    new_url = fingerprints.url('js/app.min.js')
+    assert new_url == '/static/js/app.min.js'
+    await asyncio.sleep(0.1)
+    new_url = fingerprints.url('js/app.min.js')
+    assert new_url != url
+    resp = await client.get(url, headers={'Accept-Encoding': 'identity'})
+    assert resp.status == 404
+    resp = await client.get(new_url, headers={'Accept-Encoding': 'identity'})
+    assert await resp.read() == b'let a = 22'
+    await client.close()
+
+
+async def test_small_size(aiohttp_client, monkeypatch):
+    send_module = sys.modules['aiohttp_send.send']
+
+    async def no_stream(*args, **kwargs):
+        raise AssertionError('small files are not streamed')
+
+    monkeypatch.setattr(send_module, '_write_body', no_stream)
+    app = web.Application()
+    app.router.add_get('/', wrapper('/tests/fixtures/user.json',
+                                    small_size=1024))
+    client = await aiohttp_client(app)
+    resp = await client.get('/')
+    assert resp.status == 200
+    assert await resp.json() == {'name': 'tobi'}
+    assert resp.headers['Content-Type'] == 'application/json'
+    assert 'Transfer-Encoding' not in resp.headers
+    resp = await client.get('/', headers={'Range': 'bytes=0-4'})
+    assert resp.status == 206
+    assert await resp.read() == b'{ "na'
+    await client.close()
+
+
+def test_token_bucket():
+    from aiohttp_send import TokenBucket
+    bucket = TokenBucket(rate=1000, burst=500)
+    assert bucket.reserve(500) == 0
+    assert bucket.reserve(1000) == pytest.approx(1, abs=0.01)
+    assert bucket.reserve(500) == pytest.approx(1.5, abs=0.01)
+    with pytest.raises(ValueError):
+        TokenBucket(0)
+
+
+@pytest.mark.parametrize('sendfile', [True, False])
+async def test_throttle(aiohttp_client, tmp_path, sendfile):
+    import time
+    from aiohttp_send import Throttle
+    content = os.urandom(256 * 1024)
+    (tmp_path / 'big.bin').write_bytes(content)
+    (tmp_path / 'small.txt').write_bytes(b'small')
+    throttle = Throttle(per_connection=1024 * 1024, burst=64 * 1024,
+                        per_key=4 * 1024 * 1024, key=lambda r: r.remote,
+                        min_size=1024)
+    app = web.Application()
+
+    async def handler(request):
+        return await send(request, request.match_info['name'],
+                          root=str(tmp_path), throttle=throttle,
+                          sendfile=sendfile)
+
+    app.router.add_get('/{name}', handler)
+    client = await aiohttp_client(app)
+    start = time.monotonic()
+    resp = await client.get('/big.bin')
+    assert await resp.read() == content
+    # 192KiB over the burst at 1MiB/s
+    assert time.monotonic() - start >= 0.18
+    start = time.monotonic()
+    resp = await client.get('/small.txt')
+    assert await resp.read() == b'small'
+    assert time.monotonic() - start < 0.1
+    assert len(throttle._keys) == 1
+    await client.close()